@@ -37,23 +37,24 @@ def remove_bilou_prefixes(
 __all__ = ["remove_bilou_prefixes"]
 
 if __name__ == "__main__":
-    from sys import exit, argv, stderr
+    import argparse
     import pandas
 
-    if len(argv) != 3:
-        print(f"usage: {argv[0]} input.csv output.csv", file=stderr)
-        exit(1)
-
-    input_file_path = argv[1]
-    output_file_path = argv[2]
-
-    input_df = pandas.read_csv(input_file_path)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file_path", metavar="input.csv")
+    parser.add_argument("output_file_path", metavar="output.csv")
+    parser.add_argument(
+        "--offsets-only",
+        action="store_true",
+        help="only write match offsets, words are left out",
+    )
+    args = parser.parse_args()
+
+    input_df = pandas.read_csv(args.input_file_path)
     input_dict = dfio.df_to_dict(input_df)
     input_df = None  # allows GC to free unused old data if necessary
 
     output_dict = remove_bilou_prefixes(input_dict)
     input_dict = None
 
-    output_df = dfio.dict_to_df(output_dict)
-    output_dict = None
-    output_df.to_csv(output_file_path, index=False)
+    dfio.write_csv(output_dict, args.output_file_path, offsets_only=args.offsets_only)
@@ -0,0 +1,237 @@
+#!/usr/bin/env -S uv run
+"""
+Per tag collision statistics of merged texts kept as additive state.
+
+Every count is a sum over texts, so the statistics of a corpus are updated from the texts that changed
+(see merge_data_src_v2.py --incremental) by removing the contributions of their previous version and adding the new ones,
+instead of being recomputed from every collision.
+Rates are derived from the counts when the tables are built.
+"""
+
+from collections import Counter
+from typing import Iterator, Mapping, Optional, Self
+
+import numpy
+import pandas
+
+import dfio
+from detail_collision_cmp import (
+    A_IN_B,
+    B_IN_A,
+    PERFECT_MATCH,
+    SIMPLE_OVERLAP,
+    TAG_STAT_COLUMNS,
+    span_inclusion_types,
+)
+from merge_stats import (
+    NerPositionsSourced,
+    TextCountStatistic,
+    cast_ner_position_sourced,
+)
+from overlap_categorization import CONFLICT_ERROR_COLUMNS
+from tag_match_analysis import get_merged_text_overlaps
+
+# kinds of counts, per tag
+MATCHES = "matches"  # matches of the tag, collided or not
+OFFENDER = "offender"  # collisions with a given other tag
+INCLUSION_KINDS = {
+    A_IN_B: "error_included",
+    B_IN_A: "error_includes",
+    SIMPLE_OVERLAP: "error_simple_overlap",
+    PERFECT_MATCH: "error_perfect_match",
+}
+
+
+def text_collision_counts(
+    tag_dict: NerPositionsSourced,
+) -> Counter[tuple[str, str, str]]:
+    """
+    Counts of a single merged text, keyed by (tag, kind, offending tag or "").
+
+    Each collision counts for both of its tags, as in the mirrored detailled_collisions.csv.
+    """
+    result: Counter[tuple[str, str, str]] = Counter()
+    for tag, match_list in tag_dict.items():
+        result[(tag, MATCHES, "")] += len(match_list)
+    overlaps = get_merged_text_overlaps(tag_dict)
+    if len(overlaps) == 0:
+        return result
+
+    (matches_a, matches_b) = zip(*overlaps)
+    start_a = numpy.array([match["char_start"] for match in matches_a])
+    end_a = numpy.array([match["char_end"] for match in matches_a])
+    start_b = numpy.array([match["char_start"] for match in matches_b])
+    end_b = numpy.array([match["char_end"] for match in matches_b])
+    # the same rule as detail_collision_cmp.inclusion_types, from both sides of each collision
+    inclusion_ab = span_inclusion_types(start_a, end_a, start_b, end_b).tolist()
+    inclusion_ba = span_inclusion_types(start_b, end_b, start_a, end_a).tolist()
+    for (match_a, match_b), type_ab, type_ba in zip(
+        overlaps, inclusion_ab, inclusion_ba
+    ):
+        for match, other, inclusion_type in (
+            (match_a, match_b, type_ab),
+            (match_b, match_a, type_ba),
+        ):
+            tag = match["tag"]
+            result[(tag, INCLUSION_KINDS[inclusion_type], "")] += 1
+            if tag == other["tag"]:
+                result[(tag, "error_position", "")] += 1
+            else:
+                result[(tag, "error_tag_mismatch", "")] += 1
+            result[(tag, "total_error", "")] += 1
+            result[(tag, OFFENDER, other["tag"])] += 1
+    return result
+
+
+def parse_merged_rows(
+    rows: Mapping[str, str],
+) -> Iterator[tuple[str, NerPositionsSourced]]:
+    """
+    Parses raw merged rows (sha512 to `ner_positions` field).
+
+    :raises ValueError: if a text has no `src` field
+    """
+    df = pandas.DataFrame(
+        {"sha512": list(rows.keys()), "ner_positions": list(rows.values())}
+    )
+    for text_id, ner_positions in dfio.iter_df_rows(df):
+        match cast_ner_position_sourced(ner_positions):
+            case None:
+                raise ValueError(f"text {text_id} is not merge data (no src)")
+            case tag_dict:
+                yield (text_id, tag_dict)
+
+
+class CollisionStatistic(TextCountStatistic[tuple[str, str, str]]):
+    """
+    Collision counts per tag: inclusion types, position and tag mismatch errors, offending tags and tag totals.
+
+    Meant to be passed as the accumulator of a merge (see merge_data_src_v2.MergeAccumulator),
+    then kept up to date with `update`.
+    """
+
+    def text_counts(
+        self, tag_dict: NerPositionsSourced
+    ) -> Counter[tuple[str, str, str]]:
+        return text_collision_counts(tag_dict)
+
+    def merge(self, other: "CollisionStatistic") -> Self:
+        self.counts.update(other.counts)
+        return self
+
+    def __add__(self, other: "CollisionStatistic") -> "CollisionStatistic":
+        return CollisionStatistic().merge(self).merge(other)
+
+    def _per_tag(self, kind: str) -> dict[str, int]:
+        return dict(
+            (tag, count)
+            for ((tag, count_kind, _), count) in self.counts.items()
+            if count_kind == kind
+        )
+
+    def tag_stats(self) -> pandas.DataFrame:
+        """
+        Statistics of the collided tags, as detail_collision_cmp.tag_collision_stats (indexed by tag, sorted).
+        """
+        total_error = self._per_tag("total_error")
+        matches = self._per_tag(MATCHES)
+        tags = sorted(total_error.keys())
+        result = pandas.DataFrame(
+            dict(
+                (column, [self.counts[(tag, column, "")] for tag in tags])
+                for column in TAG_STAT_COLUMNS
+                if column != "error_rate"
+            ),
+            index=pandas.Index(tags, name="tag"),
+            dtype="int64",
+        )
+        result["error_rate"] = [total_error[tag] / matches[tag] for tag in tags]
+        return result[TAG_STAT_COLUMNS]
+
+    def conflict_errors(self) -> pandas.DataFrame:
+        """
+        Conflict counts as in error_comptabilized.csv, tags and offenders sorted by name.
+        """
+        offenders: dict[str, dict[str, int]] = dict()
+        for (tag, kind, other), count in sorted(self.counts.items()):
+            if kind == OFFENDER:
+                offenders.setdefault(tag, dict())[other] = count
+        tags = sorted(offenders.keys())
+        position_error = [self.counts[(tag, "error_position", "")] for tag in tags]
+        total_error = [self.counts[(tag, "total_error", "")] for tag in tags]
+        return pandas.DataFrame(
+            {
+                "tag": tags,
+                "position_error": position_error,
+                "different_tag_error": [
+                    total - position
+                    for (total, position) in zip(total_error, position_error)
+                ],
+                "total_error": total_error,
+                "offender_list": [repr(offenders[tag]) for tag in tags],
+            }
+        )[CONFLICT_ERROR_COLUMNS]
+
+    def to_df(self) -> pandas.DataFrame:
+        rows = sorted(self.counts.items())
+        return pandas.DataFrame(
+            {
+                "tag": [tag for ((tag, _, _), _) in rows],
+                "kind": [kind for ((_, kind, _), _) in rows],
+                "other": [other for ((_, _, other), _) in rows],
+                "count": [count for (_, count) in rows],
+            }
+        )
+
+    def to_csv(self, path: str, *, source_path: Optional[str] = None) -> None:
+        """
+        Writes the counts (see `to_df`), with the fingerprint of `source_path` when given (see `describes`).
+        """
+        self._write_csv(self.to_df(), path, source_path)
+
+    @classmethod
+    def read_csv(cls, path: str) -> "CollisionStatistic":
+        df = pandas.read_csv(
+            path,
+            dtype={"tag": str, "kind": str, "other": str, "count": int},
+            keep_default_na=False,
+        )
+        result = cls()
+        for tag, kind, other, count in df[["tag", "kind", "other", "count"]].itertuples(
+            index=False, name=None
+        ):
+            result.counts[(tag, kind, other)] += count
+        result._read_source_fingerprint(df)
+        return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="builds the collision tables from collision statistics (see merge_data_src_v2.py --collision-stats)"
+    )
+    parser.add_argument("stats_path", metavar="merged.collision_stats.csv")
+    parser.add_argument(
+        "--tag-stats",
+        metavar="tag_stats.csv",
+        help="per tag statistics, as detail_collision_cmp.py --normalized",
+    )
+    parser.add_argument(
+        "--conflicts",
+        metavar="error_comptabilized.csv",
+        help="conflict counts, as overlap_categorization.py",
+    )
+    args = parser.parse_args()
+
+    stats = CollisionStatistic.read_csv(args.stats_path)
+    if args.tag_stats is not None:
+        stats.tag_stats().to_csv(
+            args.tag_stats, sep=";", index_label="tag", encoding="utf-8-sig"
+        )
+    if args.conflicts is not None:
+        stats.conflict_errors().to_csv(
+            args.conflicts, index=False, sep=";", encoding="utf-8"
+        )
+    if args.tag_stats is None and args.conflicts is None:
+        print(stats.tag_stats().to_string())
@@ -0,0 +1,20 @@
+#!/usr/bin/env -S uv run
+"""
+Expands a normalized detailled collision file (see detail_collision_cmp.py --normalized) into the mirrored view,
+every collision followed by its mirror along with the statistics of tag_a.
+"""
+
+from detail_collision_cmp import read_collisions
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path", metavar="normalized.csv")
+    parser.add_argument("output_path", metavar="output.csv")
+    parser.add_argument("--tag", help="only list the collisions of this tag")
+    args = parser.parse_args()
+
+    read_collisions(args.input_path, args.tag).to_csv(
+        args.output_path, sep=";", index=False, encoding="utf-8-sig"
+    )
@@ -1,11 +1,24 @@
 #!/usr/bin/env -S uv run
 
+import os
+
+import numpy as np
 import pandas as pd
-from dfio import NerPositionsMatch, TextToNerPositions, df_to_dict
-from merge_stats import NerPositionMatchSourced, TextToNerPositionsSourced
-from overlap_categorization import load_text_overlaps
-from tag_match_analysis import TagOverlap
-from onet import load_onet_reference
+from dfio import (
+    NerPositionsMatch,
+    TextToNerPositions,
+    df_to_dict,
+    read_reference_texts,
+    sidecar_path,
+)
+from merge_stats import (
+    TagSourceStatistic,
+    TextToNerPositionsSourced,
+)
+from overlap_categorization import load_overlap_table
+from onet import ONET_REFERENCE_PATH, onet_labels
+from sources import first_source
+from xlsx_report import write_df_by_major_tag
 from typing import Optional, cast, NamedTuple
 from ast import literal_eval
 
@@ -16,52 +29,6 @@ PERFECT_MATCH = 3
 SIMPLE_OVERLAP = 0
 
 
-class ExtendedConflictInfo(NamedTuple):
-    text_sha: str
-
-    error_included: int
-    error_includes: int
-    error_simple_overlap: int
-    error_perfect_match: int
-
-    error_position: int
-    error_tag_mismatch: int
-    total_error: int
-    error_rate: float
-
-    tag_a: str
-    start_a: int
-    end_a: int
-    word_a: str
-    src_a: str
-
-    tag_b: str
-    start_b: int
-    end_b: int
-    word_b: str
-    src_b: str
-
-
-class TagStat(NamedTuple):
-    error_included: int
-    error_includes: int
-    error_simple_overlap: int
-    error_perfect_match: int
-
-    error_position: int
-    error_tag_mismatch: int
-
-    total_error: int
-    error_rate: float
-
-
-# class TagStat(NamedTuple):
-#     tag: str
-#     error_included: int
-#     error_includes: int
-#     error_rate: float
-
-
 class TagWithWord(NamedTuple):
     tag: str
     start: int
@@ -82,6 +49,52 @@ class TagErrorRate(NamedTuple):
     offenders: dict[str, int]
 
 
+# columns of a collision stored once (normalized output)
+COLLISION_COLUMNS = [
+    "text_sha",
+    "tag_a",
+    "onet_a",
+    "start_a",
+    "end_a",
+    "word_a",
+    "src_a",
+    "tag_b",
+    "onet_b",
+    "start_b",
+    "end_b",
+    "word_b",
+    "src_b",
+]
+POSITION_COLUMNS = ["tag_a", "start_a", "end_a", "tag_b", "start_b", "end_b"]
+
+# columns of the default output: every collision and its mirror, along with the statistics of tag_a
+DETAILLED_COLUMNS = [
+    "text_sha",
+    "error_included",
+    "error_includes",
+    "error_simple_overlap",
+    "error_perfect_match",
+    "error_position",
+    "error_tag_mismatch",
+    "total_error",
+    "error_rate",
+    "tag_a",
+    "onet_a",
+    "start_a",
+    "end_a",
+    "word_a",
+    "src_a",
+    "tag_b",
+    "onet_b",
+    "start_b",
+    "end_b",
+    "word_b",
+    "src_b",
+]
+
+# per tag statistics stored next to a normalized output
+TAG_STATS_SUFFIX = ".tag_stats.csv"
+
 TagList = list[NerPositionsMatch]
 TagWithWordList = list[TagWithWord]
 
@@ -91,421 +104,237 @@ def main(
     merged_matches_path: str,
     reference_text_path: str,
     output_path: str,
+    *,
+    normalized: bool = False,
+    xlsx_path: Optional[str] = None,
+    onet_path: str = ONET_REFERENCE_PATH,
 ) -> None:
-    # Load colisions from csv
-    input_df = pd.read_csv(colision_path, low_memory=False)
-    text_overlaps: dict[str, list[TagOverlap]] = load_text_overlaps(input_df)
+    # Load colisions from csv, tags such as "NA" are kept as text
+    input_df = pd.read_csv(colision_path, low_memory=False, keep_default_na=False)
+    collisions = collision_table(load_overlap_table(input_df))
+    input_df = None  # allows GC to free memory
 
-    # Load refrence texts from csv
-    input_df = pd.read_csv(
-        reference_text_path, low_memory=False, sep=";", encoding="utf-8-sig"
+    # Load the refrence texts of the colisions only
+    reference_texts = read_reference_texts(
+        reference_text_path, collisions["text_sha"].unique()
     )
-    reference_texts = load_reference_texts(input_df)
 
-    input_df = pd.read_csv(merged_matches_path, low_memory=False)
+    per_tag_counts = load_per_tag_count(merged_matches_path)
 
-    all_tags = df_to_dict(input_df)
-    input_df = None  # allows GC to free memory
+    collisions = add_matched_words(collisions, reference_texts)
+    reference_texts = None
+    collisions = add_onet_ref(collisions, onet_path)
 
-    per_tag_data = get_per_tag_data(all_tags)
-    all_tags = None
-    per_tag_counts = get_per_tag_count(per_tag_data)
-    per_tag_data = None
+    if normalized:
+        # statistics only need the positions of the mirrored collisions
+        tag_stats = tag_collision_stats(
+            mirror_collisions(collisions[POSITION_COLUMNS]), per_tag_counts
+        )
+        collisions[COLLISION_COLUMNS].to_csv(
+            output_path, sep=";", index=False, encoding="utf-8-sig"
+        )
+        tag_stats.to_csv(
+            sidecar_path(output_path, TAG_STATS_SUFFIX),
+            sep=";",
+            index_label="tag",
+            encoding="utf-8-sig",
+        )
+        if xlsx_path is not None:
+            write_df_by_major_tag(
+                xlsx_path,
+                collisions[COLLISION_COLUMNS],
+                "tag_a",
+                extra_sheets={"tag_stats": tag_stats.reset_index(names="tag")},
+            )
+        return
 
-    result = colision_to_extended_collision(text_overlaps)
-    result = retrieve_word_match(result, reference_texts)
-    result = denormalize_eci_list(result)
-    result = compute_eci_stats(result, per_tag_counts)
+    collisions = mirror_collisions(collisions)
+    tag_stats = tag_collision_stats(collisions, per_tag_counts)
 
-    output_df = eci_to_df(result)
-    output_df = post_add_onet_ref(output_df)
+    output_df = join_tag_stats(collisions, tag_stats)[DETAILLED_COLUMNS]
     output_df.to_csv(output_path, sep=";", index=False, encoding="utf-8-sig")
+    if xlsx_path is not None:
+        write_df_by_major_tag(xlsx_path, output_df, "tag_a")
 
 
-def alter_eci(
-    template_eci: ExtendedConflictInfo,
-    *,
-    text_sha: Optional[str] = None,
-    error_included: Optional[int] = None,
-    error_includes: Optional[int] = None,
-    error_simple_overlap: Optional[int] = None,
-    error_perfect_match: Optional[int] = None,
-    error_position: Optional[int] = None,
-    error_tag_mismatch: Optional[int] = None,
-    total_error: Optional[int] = None,
-    error_rate: Optional[float] = None,
-    tag_a: Optional[str] = None,
-    start_a: Optional[int] = None,
-    end_a: Optional[int] = None,
-    word_a: Optional[str] = None,
-    src_a: Optional[str] = None,
-    tag_b: Optional[str] = None,
-    start_b: Optional[int] = None,
-    end_b: Optional[int] = None,
-    word_b: Optional[str] = None,
-    src_b: Optional[str] = None,
-) -> ExtendedConflictInfo:
+def read_collisions(path: str, tag: Optional[str] = None) -> pd.DataFrame:
     """
-    Creates a copy of the input ExtendedConflictInfo and return a version with the specified modifications
-
-    If a keyword argument is specified then the coresponding key in the resultin named tuple will be modified.
-    All other keys will be identical to the template_eci.
+    Loads a detailled collision file written with `normalized` as the default (mirrored) output,
+    restricted to the collisions of `tag` (as tag_a) when given.
     """
-    (
-        text_sha_old,
-        error_included_old,
-        error_includes_old,
-        error_simple_overlap_old,
-        error_perfect_match_old,
-        error_position_old,
-        error_tag_mismatch_old,
-        total_error_old,
-        error_rate_old,
-        tag_a_old,
-        start_a_old,
-        end_a_old,
-        word_a_old,
-        src_a_old,
-        tag_b_old,
-        start_b_old,
-        end_b_old,
-        word_b_old,
-        src_b_old,
-    ) = template_eci
-
-    text_sha = text_sha_old if text_sha is None else text_sha
-    error_included = error_included_old if error_included is None else error_included
-    error_includes = error_includes_old if error_includes is None else error_includes
-    error_simple_overlap = (
-        error_simple_overlap_old
-        if error_simple_overlap is None
-        else error_simple_overlap
-    )
-    error_perfect_match = (
-        error_perfect_match_old if error_perfect_match is None else error_perfect_match
-    )
-    error_position = error_position_old if error_position is None else error_position
-    error_tag_mismatch = (
-        error_tag_mismatch_old if error_tag_mismatch is None else error_tag_mismatch
+    collisions = pd.read_csv(path, sep=";", encoding="utf-8-sig", keep_default_na=False)
+    tag_stats = pd.read_csv(
+        sidecar_path(path, TAG_STATS_SUFFIX),
+        sep=";",
+        encoding="utf-8-sig",
+        index_col="tag",
+        keep_default_na=False,
+        float_precision="round_trip",
     )
-    total_error = total_error_old if total_error is None else total_error
-    error_rate = error_rate_old if error_rate is None else error_rate
-    tag_a = tag_a_old if tag_a is None else tag_a
-    start_a = start_a_old if start_a is None else start_a
-    end_a = end_a_old if end_a is None else end_a
-    word_a = word_a_old if word_a is None else word_a
-    src_a = src_a_old if src_a is None else src_a
-    tag_b = tag_b_old if tag_b is None else tag_b
-    start_b = start_b_old if start_b is None else start_b
-    end_b = end_b_old if end_b is None else end_b
-    word_b = word_b_old if word_b is None else word_b
-    src_b = src_b_old if src_b is None else src_b
-
-    return ExtendedConflictInfo(
-        text_sha,
-        error_included,
-        error_includes,
-        error_simple_overlap,
-        error_perfect_match,
-        error_position,
-        error_tag_mismatch,
-        total_error,
-        error_rate,
-        tag_a,
-        start_a,
-        end_a,
-        word_a,
-        src_a,
-        tag_b,
-        start_b,
-        end_b,
-        word_b,
-        src_b,
+    if tag is not None:
+        collisions = collisions[
+            (collisions["tag_a"] == tag) | (collisions["tag_b"] == tag)
+        ]
+    collisions = mirror_collisions(collisions)
+    if tag is not None:
+        collisions = collisions[collisions["tag_a"] == tag]
+    return cast(pd.DataFrame, join_tag_stats(collisions, tag_stats)[DETAILLED_COLUMNS])
+
+
+def _first_source_names(src_masks: pd.Series) -> np.ndarray:
+    names = dict(
+        (src_mask, first_source(int(src_mask))) for src_mask in src_masks.unique()
     )
+    return src_masks.map(names).to_numpy()
 
 
-def colision_to_extended_collision(
-    colisions: dict[str, list[TagOverlap]],
-) -> list[ExtendedConflictInfo]:
-    result: list[ExtendedConflictInfo] = []
-    for text_id, conflict_list in colisions.items():
-        for match_a, match_b in conflict_list:
-            eci = ExtendedConflictInfo(
-                text_id,
-                0,
-                0,
-                0,
-                0,
-                0,
-                0,
-                0,
-                0.0,
-                match_a["tag"],
-                match_a["char_start"],
-                match_a["char_end"],
-                "",
-                match_a["src"][0],
-                match_b["tag"],
-                match_b["char_start"],
-                match_b["char_end"],
-                "",
-                match_b["src"][0],
-            )
-            result.append(eci)
-    return result
-
+def collision_table(overlaps: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per collision of an overlap table (see overlap_categorization.load_overlap_table),
+    texts in order of first appearance.
 
-def retrieve_word_match(
-    eci_list: list[ExtendedConflictInfo], ref_texts: dict[str, str]
-) -> list[ExtendedConflictInfo]:
-    result: list[ExtendedConflictInfo] = []
-    for eci in eci_list:
-        text = ref_texts[eci.text_sha]
-        word_a = text[eci.start_a : eci.end_a]
-        word_b = text[eci.start_b : eci.end_b]
-        new_eci = alter_eci(eci, word_a=word_a, word_b=word_b)
-        result.append(new_eci)
-    return result
+    Columns: text_sha, tag_a, start_a, end_a, src_a (first source name) and the same for b.
+    """
+    text_order = np.argsort(pd.factorize(overlaps["text_id"])[0], kind="stable")
+    overlaps = overlaps.iloc[text_order]
+    return pd.DataFrame(
+        {
+            "text_sha": overlaps["text_id"].to_numpy(),
+            "tag_a": overlaps["tag_a"].astype(str).to_numpy(),
+            "start_a": overlaps["char_start_a"].to_numpy(),
+            "end_a": overlaps["char_end_a"].to_numpy(),
+            "src_a": _first_source_names(overlaps["src_a"]),
+            "tag_b": overlaps["tag_b"].astype(str).to_numpy(),
+            "start_b": overlaps["char_start_b"].to_numpy(),
+            "end_b": overlaps["char_end_b"].to_numpy(),
+            "src_b": _first_source_names(overlaps["src_b"]),
+        }
+    )
 
 
-def get_inclusion_type(eci: ExtendedConflictInfo) -> int:
-    if eci.start_a == eci.start_b and eci.end_a == eci.end_b:
-        return PERFECT_MATCH
-    if eci.start_a >= eci.start_b and eci.end_a <= eci.end_b:
-        return A_IN_B
-    if eci.start_a <= eci.start_b and eci.end_a >= eci.end_b:
-        return B_IN_A
-    return SIMPLE_OVERLAP
-
-
-def denormalize_eci_list(
-    eci_list: list[ExtendedConflictInfo],
-) -> list[ExtendedConflictInfo]:
-    result: list[ExtendedConflictInfo] = []
-    for eci in eci_list:
-        result.append(eci)
-        tag_a = eci.tag_a
-        start_a = eci.start_a
-        end_a = eci.end_a
-        word_a = eci.word_a
-        src_a = eci.src_a
-        tag_b = eci.tag_b
-        start_b = eci.start_b
-        end_b = eci.end_b
-        word_b = eci.word_b
-        src_b = eci.src_b
-        result.append(
-            alter_eci(
-                eci,
-                tag_a=tag_b,
-                start_a=start_b,
-                end_a=end_b,
-                word_a=word_b,
-                src_a=src_b,
-                tag_b=tag_a,
-                start_b=start_a,
-                end_b=end_a,
-                word_b=word_a,
-                src_b=src_a,
+def add_matched_words(
+    collisions: pd.DataFrame, ref_texts: dict[str, str]
+) -> pd.DataFrame:
+    """
+    Adds the word_a and word_b columns, sliced from the reference texts.
+    """
+    result = collisions.copy()
+    for side in ("a", "b"):
+        result[f"word_{side}"] = [
+            ref_texts[text_id][start:end]
+            for (text_id, start, end) in zip(
+                result["text_sha"], result[f"start_{side}"], result[f"end_{side}"]
             )
-        )
+        ]
     return result
 
 
-def post_add_onet_ref(df: pd.DataFrame) -> pd.DataFrame:
-    tag_ref = load_onet_reference()
-    df["onet_a"] = df["tag_a"].apply(lambda t: tag_ref.setdefault(t, ""))
-    df["onet_b"] = df["tag_b"].apply(lambda t: tag_ref.setdefault(t, ""))
-    return cast(
-        pd.DataFrame,
-        df[
-            [
-                "text_sha",
-                "error_included",
-                "error_includes",
-                "error_simple_overlap",
-                "error_perfect_match",
-                "error_position",
-                "error_tag_mismatch",
-                "total_error",
-                "error_rate",
-                "tag_a",
-                "onet_a",
-                "start_a",
-                "end_a",
-                "word_a",
-                "src_a",
-                "tag_b",
-                "onet_b",
-                "start_b",
-                "end_b",
-                "word_b",
-                "src_b",
-            ]
+def mirror_collisions(collisions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Follows every collision with its mirror (a and b swapped), so each match is listed as a once.
+    """
+    swap = dict()
+    for column in collisions.columns:
+        if column.endswith("_a"):
+            swap[column] = column[:-2] + "_b"
+        elif column.endswith("_b"):
+            swap[column] = column[:-2] + "_a"
+    mirrored = collisions.rename(columns=swap)[collisions.columns]
+    row_count = len(collisions)
+    interleaved = np.column_stack(
+        [np.arange(row_count), np.arange(row_count) + row_count]
+    ).ravel()
+    return pd.concat([collisions, mirrored], ignore_index=True).iloc[interleaved]
+
+
+def span_inclusion_types(
+    start_a: np.ndarray, end_a: np.ndarray, start_b: np.ndarray, end_b: np.ndarray
+) -> np.ndarray:
+    """
+    How each span a lies relatively to the span b it collides with (PERFECT_MATCH, A_IN_B, B_IN_A or SIMPLE_OVERLAP).
+    """
+    return np.select(
+        [
+            (start_a == start_b) & (end_a == end_b),
+            (start_a >= start_b) & (end_a <= end_b),
+            (start_a <= start_b) & (end_a >= end_b),
         ],
+        [PERFECT_MATCH, A_IN_B, B_IN_A],
+        SIMPLE_OVERLAP,
     )
 
 
-def compute_eci_stats(
-    eci_list: list[ExtendedConflictInfo],
-    all_tags_count: dict[str, int],
-) -> list[ExtendedConflictInfo]:
-    global A_IN_B, B_IN_A, PERFECT_MATCH, SIMPLE_OVERLAP
-    cached_tag_stats: dict[str, TagStat] = dict()
-    work_dict: dict[str, list[ExtendedConflictInfo]] = dict()
-    for eci in eci_list:
-        per_tag_conflict_list = work_dict.setdefault(eci.tag_a, [])
-        per_tag_conflict_list.append(eci)
-
-    for tag, per_tag_conflict_list in work_dict.items():
-        error_included: int = 0
-        error_includes: int = 0
-        error_simple_overlap: int = 0
-        error_perfect_match: int = 0
-        error_position: int = 0
-        error_tag_mismatch: int = 0
-        total_error = len(per_tag_conflict_list)
-        error_rate: float = total_error / all_tags_count[tag]
-        for eci in per_tag_conflict_list:
-            match get_inclusion_type(eci):
-                case i if i == A_IN_B:
-                    error_included += 1
-                case i if i == B_IN_A:
-                    error_includes += 1
-                case i if i == PERFECT_MATCH:
-                    error_perfect_match += 1
-                case i if i == SIMPLE_OVERLAP:
-                    error_simple_overlap += 1
-
-            if eci.tag_a == eci.tag_b:
-                error_position += 1
-            else:
-                error_tag_mismatch += 1
-
-        cached_tag_stats[tag] = TagStat(
-            error_included,
-            error_includes,
-            error_simple_overlap,
-            error_perfect_match,
-            error_position,
-            error_tag_mismatch,
-            total_error,
-            error_rate,
-        )
+def inclusion_types(collisions: pd.DataFrame) -> np.ndarray:
+    return span_inclusion_types(
+        collisions["start_a"].to_numpy(),
+        collisions["end_a"].to_numpy(),
+        collisions["start_b"].to_numpy(),
+        collisions["end_b"].to_numpy(),
+    )
 
-    return list((add_stat_to_eci(eci, cached_tag_stats[eci.tag_a]) for eci in eci_list))
-
-
-def eci_to_df(eci_list: list[ExtendedConflictInfo]) -> pd.DataFrame:
-    text_sha_list = []
-    error_included_list = []
-    error_includes_list = []
-    error_simple_overlap_list = []
-    error_perfect_match_list = []
-    error_position_list = []
-    error_tag_mismatch_list = []
-    total_error_list = []
-    error_rate_list = []
-    tag_a_list = []
-    start_a_list = []
-    end_a_list = []
-    word_a_list = []
-    src_a_list = []
-    tag_b_list = []
-    start_b_list = []
-    end_b_list = []
-    word_b_list = []
-    src_b_list = []
-
-    for (
-        text_sha,
-        error_included,
-        error_includes,
-        error_simple_overlap,
-        error_perfect_match,
-        error_position,
-        error_tag_mismatch,
-        total_error,
-        error_rate,
-        tag_a,
-        start_a,
-        end_a,
-        word_a,
-        src_a,
-        tag_b,
-        start_b,
-        end_b,
-        word_b,
-        src_b,
-    ) in eci_list:
-        text_sha_list.append(text_sha)
-        error_included_list.append(error_included)
-        error_includes_list.append(error_includes)
-        error_simple_overlap_list.append(error_simple_overlap)
-        error_perfect_match_list.append(error_perfect_match)
-        error_position_list.append(error_position)
-        error_tag_mismatch_list.append(error_tag_mismatch)
-        total_error_list.append(total_error)
-        error_rate_list.append(error_rate)
-        tag_a_list.append(tag_a)
-        start_a_list.append(start_a)
-        end_a_list.append(end_a)
-        word_a_list.append(word_a)
-        src_a_list.append(src_a)
-        tag_b_list.append(tag_b)
-        start_b_list.append(start_b)
-        end_b_list.append(end_b)
-        word_b_list.append(word_b)
-        src_b_list.append(src_b)
 
-    return pd.DataFrame(
-        {
-            "text_sha": text_sha_list,
-            "error_included": error_included_list,
-            "error_includes": error_includes_list,
-            "error_simple_overlap": error_simple_overlap_list,
-            "error_perfect_match": error_perfect_match_list,
-            "error_position": error_position_list,
-            "error_tag_mismatch": error_tag_mismatch_list,
-            "total_error": total_error_list,
-            "error_rate": error_rate_list,
-            "tag_a": tag_a_list,
-            "start_a": start_a_list,
-            "end_a": end_a_list,
-            "word_a": word_a_list,
-            "src_a": src_a_list,
-            "tag_b": tag_b_list,
-            "start_b": start_b_list,
-            "end_b": end_b_list,
-            "word_b": word_b_list,
-            "src_b": src_b_list,
-        }
-    )
+def add_onet_ref(
+    df: pd.DataFrame, onet_path: str = ONET_REFERENCE_PATH
+) -> pd.DataFrame:
+    """
+    Adds the onet_a and onet_b columns, the O*NET example of each tag (empty for unknown tags).
+    """
+    result = df.copy()
+    result["onet_a"] = onet_labels(result["tag_a"], onet_path)
+    result["onet_b"] = onet_labels(result["tag_b"], onet_path)
+    return result
+
 
+TAG_STAT_COLUMNS = [
+    "error_included",
+    "error_includes",
+    "error_simple_overlap",
+    "error_perfect_match",
+    "error_position",
+    "error_tag_mismatch",
+    "total_error",
+    "error_rate",
+]
+
+
+def tag_collision_stats(
+    collisions: pd.DataFrame, all_tags_count: dict[str, int]
+) -> pd.DataFrame:
+    """
+    Counts the collisions of each tag (as tag_a) per inclusion type and tag mismatch, indexed by tag.
 
-def add_stat_to_eci(eci: ExtendedConflictInfo, stat: TagStat) -> ExtendedConflictInfo:
-    (
-        error_included,
-        error_includes,
-        error_simple_overlap,
-        error_perfect_match,
-        error_position,
-        error_tag_mismatch,
-        total_error,
-        error_rate,
-    ) = stat
-
-    return alter_eci(
-        eci,
-        error_included=error_included,
-        error_includes=error_includes,
-        error_simple_overlap=error_simple_overlap,
-        error_perfect_match=error_perfect_match,
-        error_position=error_position,
-        error_tag_mismatch=error_tag_mismatch,
-        total_error=total_error,
-        error_rate=error_rate,
+    error_rate is the share of the matches of the tag involved in a collision.
+    """
+    inclusion = inclusion_types(collisions)
+    same_tag = collisions["tag_a"].to_numpy() == collisions["tag_b"].to_numpy()
+    result = (
+        pd.DataFrame(
+            {
+                "tag": collisions["tag_a"].to_numpy(),
+                "error_included": inclusion == A_IN_B,
+                "error_includes": inclusion == B_IN_A,
+                "error_simple_overlap": inclusion == SIMPLE_OVERLAP,
+                "error_perfect_match": inclusion == PERFECT_MATCH,
+                "error_position": same_tag,
+                "error_tag_mismatch": ~same_tag,
+                "total_error": np.ones(len(collisions), dtype="int64"),
+            }
+        )
+        .groupby("tag", sort=False)
+        .sum()
+        .astype("int64")
+    )
+    result["error_rate"] = result["total_error"] / np.array(
+        [all_tags_count[tag] for tag in result.index], dtype="int64"
     )
+    return result[TAG_STAT_COLUMNS]
+
+
+def join_tag_stats(collisions: pd.DataFrame, tag_stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds to every collision the statistics of its tag_a.
+    """
+    return collisions.merge(tag_stats, how="left", left_on="tag_a", right_index=True)
 
 
 def get_per_tag_data(all_tag: TextToNerPositions) -> dict[str, list[PerTagData]]:
@@ -532,6 +361,25 @@ def get_per_tag_count(per_tag_data: dict[str, list[PerTagData]]) -> dict[str, in
     )
 
 
+def load_per_tag_count(merged_matches_path: str) -> dict[str, int]:
+    """
+    Counts the matches of every tag in a merged file.
+
+    The statistics written next to the merged file by the merge (see merge_stats.TagSourceStatistic) are read when they record the fingerprint of its current content,
+    otherwise the whole merged file is loaded and counted.
+    """
+    stats_path = sidecar_path(merged_matches_path, ".stats.csv")
+    if os.path.exists(stats_path):
+        merge_stats = TagSourceStatistic.read_csv(stats_path)
+        if merge_stats.describes(merged_matches_path):
+            return merge_stats.tag_count
+
+    input_df = pd.read_csv(merged_matches_path, low_memory=False)
+    all_tags = df_to_dict(input_df)
+    input_df = None
+    return get_per_tag_count(get_per_tag_data(all_tags))
+
+
 def load_collision_rates(input_df: pd.DataFrame) -> dict[str, TagErrorRate]:
     df = cast(
         pd.DataFrame,
@@ -582,14 +430,6 @@ def load_match_data(df: pd.DataFrame) -> TextToNerPositionsSourced:
     return cast(TextToNerPositionsSourced, result)
 
 
-def load_reference_texts(df: pd.DataFrame) -> dict[str, str]:
-    df = cast(pd.DataFrame, df[["sha512", "description"]])
-    df = df.astype({"sha512": str, "description": str})
-    df = cast(pd.DataFrame, df[df.notna().all(axis=1)])
-
-    return dict(df.itertuples(index=False, name=None))
-
-
 def extract_src_match(src_text: str, pos_match: NerPositionsMatch) -> str:
     return src_text[pos_match["char_start"] : pos_match["char_end"]]
 
@@ -609,18 +449,38 @@ def find_tag_word(src_text: str, tag_list: TagList, tag_name: str) -> TagWithWor
 
 
 if __name__ == "__main__":
-    import sys
-
-    if len(sys.argv) != 5:
-        print(
-            f"usage: {sys.argv[0]} colisions.csv merged_matches.csv reference_texts.csv output.csv",
-            file=sys.stderr,
-        )
-        sys.exit(0)
-
-    colision_path = sys.argv[1]
-    merged_matches_path = sys.argv[2]
-    reference_text_path = sys.argv[3]
-    output_path = sys.argv[4]
-
-    main(colision_path, merged_matches_path, reference_text_path, output_path)
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("colision_path", metavar="colisions.csv")
+    parser.add_argument("merged_matches_path", metavar="merged_matches.csv")
+    parser.add_argument("reference_text_path", metavar="reference_texts.csv")
+    parser.add_argument("output_path", metavar="output.csv")
+    parser.add_argument(
+        "--normalized",
+        action="store_true",
+        help=f"store each collision once, per tag statistics go to output{TAG_STATS_SUFFIX}"
+        " (see collision_view.py)",
+    )
+    parser.add_argument(
+        "--xlsx",
+        metavar="report.xlsx",
+        help="also write the output as a workbook, one sheet per major tag (of tag_a)",
+    )
+    parser.add_argument(
+        "--onet-reference",
+        metavar="Onet_association_fixed.csv",
+        default=ONET_REFERENCE_PATH,
+        help="tag to O*NET example table (default: the one of the data directory next to this script)",
+    )
+    args = parser.parse_args()
+
+    main(
+        args.colision_path,
+        args.merged_matches_path,
+        args.reference_text_path,
+        args.output_path,
+        normalized=args.normalized,
+        xlsx_path=args.xlsx,
+        onet_path=args.onet_reference,
+    )
@@ -5,15 +5,33 @@ This module allows the extraction/insertion of ner_positions data per text from/
 if __name__ == "__main__":
     raise RuntimeError("This module is not intended to be executed directly")
 
+import csv
+import hashlib
+import io
+import os
+import struct
 from ast import literal_eval
-from typing import Any, Optional, Required, TypedDict, cast
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Collection,
+    Iterator,
+    NotRequired,
+    Optional,
+    Required,
+    Self,
+    TypedDict,
+    cast,
+)
 from itertools import tee
+from operator import itemgetter
 
+import numpy
 import pandas
 
 
 class NerPositionsMatch(TypedDict):
-    word: Required[str]
+    word: NotRequired[str]  # absent from offset-only data, see materialize_words
     char_start: Required[int]
     char_end: Required[int]
 
@@ -40,7 +58,7 @@ def _validate_ner_possition_format(maybe_ner: Any) -> Optional[NerPositions]:
         for match_position in match_list:
             if not isinstance(match_position, dict):
                 return None
-            if not isinstance(match_position.get("word"), str):
+            if "word" in match_position and not isinstance(match_position["word"], str):
                 return None
             if not isinstance(match_position.get("char_start"), int):
                 return None
@@ -49,14 +67,14 @@ def _validate_ner_possition_format(maybe_ner: Any) -> Optional[NerPositions]:
     return cast(NerPositions, maybe_ner)
 
 
-def df_to_dict(
+def iter_df_rows(
     input_df: pandas.DataFrame,
     *,
     do_not_throw: bool = True,
     err_idx: Optional[list[int]] = None,
-) -> TextToNerPositions:
+) -> Iterator[tuple[str, NerPositions]]:
     """
-    Morphs a loaded DataFrame into a processable data structure.
+    Parses the rows of a loaded DataFrame one by one, in order.
 
     The DataFrame is expected to contain the following columns: sha512, ner_positions.
 
@@ -73,7 +91,6 @@ def df_to_dict(
 
     df = input_df[["sha512", "ner_positions"]]
 
-    result: TextToNerPositions = dict()
     for idx, text_id, ner_positions_raw in df.itertuples(index=True, name=None):
         if not isinstance(text_id, str):
             if err_idx is not None:
@@ -111,20 +128,459 @@ def df_to_dict(
                     raise ValueError(f"ner_position has wrong shape at row {idx}")
 
             case ner_positions:
-                tag_dict = ner_positions  # _ner_positions_into_tag_to_match_dict(ner_positions)
-                result[text_id] = tag_dict
+                yield (text_id, ner_positions)
 
-    return result
+
+def df_to_dict(
+    input_df: pandas.DataFrame,
+    *,
+    do_not_throw: bool = True,
+    err_idx: Optional[list[int]] = None,
+) -> TextToNerPositions:
+    """
+    Morphs a loaded DataFrame into a processable data structure.
+
+    The DataFrame is expected to contain the following columns: sha512, ner_positions.
+
+    :param input_df: the dataframe to process.
+    :param do_not_throw: should error be silently ignored instead of raising an exception.
+    :err_idx: add indexes of eroneous rows to this list
+    :raises ValueError: on malformed input if ignore_error is set to False
+    """
+    return dict(iter_df_rows(input_df, do_not_throw=do_not_throw, err_idx=err_idx))
+
+
+def iter_csv_rows(
+    path: str, *, chunksize: int = 1024, do_not_throw: bool = True
+) -> Iterator[tuple[str, NerPositions]]:
+    """
+    Streams the rows of a csv file in order, only `chunksize` rows are held in memory at once.
+
+    Malformed rows are handled as in `df_to_dict`.
+    """
+    with pandas.read_csv(
+        path, usecols=["sha512", "ner_positions"], chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            yield from iter_df_rows(chunk, do_not_throw=do_not_throw)
 
 
-def dict_to_df(text_dict: TextToNerPositions) -> pandas.DataFrame:
-    itt1, itt2 = tee(text_dict.items())
+def _strip_words(ner_positions: NerPositions) -> NerPositions:
+    return dict(
+        (
+            tag,
+            [
+                cast(NerPositionsMatch, {k: v for (k, v) in m.items() if k != "word"})
+                for m in match_list
+            ],
+        )
+        for (tag, match_list) in ner_positions.items()
+    )
+
+
+def dict_to_df(
+    text_dict: TextToNerPositions, *, offsets_only: bool = False
+) -> pandas.DataFrame:
+    """
+    Morphs a processable data structure back into a DataFrame suitable as output, rows are sorted by sha512.
+
+    :param text_dict: the data to morph.
+    :param offsets_only: drop the `word` of every match, only offsets are kept.
+    """
+    itt1, itt2 = tee(sorted(text_dict.items(), key=itemgetter(0)))
     return pandas.DataFrame(
         {
             "sha512": (text_id for (text_id, _) in itt1),
-            "ner_positions": (str(ner_positions) for (_, ner_positions) in itt2),
+            "ner_positions": (
+                str(_strip_words(ner_positions) if offsets_only else ner_positions)
+                for (_, ner_positions) in itt2
+            ),
         }
     )
 
 
+# sidecar index of a csv file written by NerPositionsWriter, see NerPositionsIndex
+INDEX_SUFFIX = ".idx"
+_INDEX_MAGIC = b"NERPIDX2"
+# magic, key width, row count, size and modification time (ns) of the indexed csv file
+_INDEX_HEADER = struct.Struct("<8sIQQq")
+
+
+def _write_index(
+    index_path: str, text_ids: list[bytes], offsets: list[int], csv_stat: os.stat_result
+) -> None:
+    key_width = max(1, max(map(len, text_ids), default=1))
+    with open(index_path, "wb") as index_file:
+        index_file.write(
+            _INDEX_HEADER.pack(
+                _INDEX_MAGIC,
+                key_width,
+                len(text_ids),
+                csv_stat.st_size,
+                csv_stat.st_mtime_ns,
+            )
+        )
+        index_file.write(numpy.array(text_ids, dtype=f"S{key_width}").tobytes())
+        index_file.write(numpy.array(offsets, dtype="<u8").tobytes())
+
+
+class NerPositionsWriter:
+    """
+    Writes texts one at a time to a csv file, in the same format as `dict_to_df(...).to_csv(path, index=False)`.
+
+    Unless `index` is False, texts must be written in strictly increasing sha512 order
+    and a sidecar index of their byte offsets is written on close (see `NerPositionsIndex`).
+    Rows go to a temporary file that replaces `path` on close, so a failed write leaves any previous file as it was.
+    Meant to be used as a context manager.
+
+    :raises ValueError: when indexing and a text is written out of order
+    """
+
+    def __init__(self, path: str, *, offsets_only: bool = False, index: bool = True):
+        self._path = path
+        self._tmp_path = path + ".tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._row_buffer = io.StringIO(newline="")
+        self._writer = csv.writer(self._row_buffer, lineterminator=os.linesep)
+        self._offsets_only = offsets_only
+        self._index_path: Optional[str] = (
+            sidecar_path(path, INDEX_SUFFIX) if index else None
+        )
+        self._text_ids: list[bytes] = []
+        self._offsets: list[int] = []
+        self._size = 0
+
+        self._write_row(["sha512", "ner_positions"])
+
+    def _write_row(self, row: list[str]) -> None:
+        self._row_buffer.seek(0)
+        self._row_buffer.truncate()
+        self._writer.writerow(row)
+        encoded_row = self._row_buffer.getvalue().encode("utf-8")
+        self._file.write(encoded_row)
+        self._size += len(encoded_row)
+
+    def write_raw(self, text_id: str, ner_positions_raw: str) -> None:
+        """
+        Writes an already formatted `ner_positions` field.
+        """
+        if self._index_path is not None:
+            encoded_id = text_id.encode("utf-8")
+            if self._text_ids and encoded_id <= self._text_ids[-1]:
+                raise ValueError(
+                    f"texts must be written in strictly increasing sha512 order to be indexed: {text_id} after {self._text_ids[-1].decode('utf-8')}"
+                )
+            self._text_ids.append(encoded_id)
+            self._offsets.append(self._size)
+        self._write_row([text_id, ner_positions_raw])
+
+    def write(self, text_id: str, ner_positions: NerPositions) -> None:
+        if self._offsets_only:
+            ner_positions = _strip_words(ner_positions)
+        self.write_raw(text_id, str(ner_positions))
+
+    def close(self) -> None:
+        self._file.close()
+        if self._index_path is not None and os.path.exists(self._index_path):
+            os.remove(self._index_path)  # never leave a stale index behind
+        os.replace(self._tmp_path, self._path)
+        if self._index_path is not None:
+            _write_index(
+                self._index_path, self._text_ids, self._offsets, os.stat(self._path)
+            )
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, *_) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # an incomplete output is dropped
+            self._file.close()
+            os.remove(self._tmp_path)
+
+
+def write_csv(
+    text_dict: TextToNerPositions, path: str, *, offsets_only: bool = False
+) -> None:
+    """
+    Writes texts sorted by sha512 to a csv file along with its sidecar index (see `NerPositionsIndex`).
+
+    The csv file is the same as `dict_to_df(text_dict, offsets_only=offsets_only).to_csv(path, index=False)`.
+    """
+    with NerPositionsWriter(path, offsets_only=offsets_only) as writer:
+        for text_id, ner_positions in sorted(text_dict.items(), key=itemgetter(0)):
+            writer.write(text_id, ner_positions)
+
+
+class NerPositionsIndex:
+    """
+    Random access to the rows of a csv file written by `NerPositionsWriter` or `write_csv`, through its sidecar index.
+
+    A lookup is a binary search over the memory mapped index followed by a single seek in the csv file.
+    Meant to be used as a context manager.
+
+    :raises ValueError: if the index is missing its header or does not match the csv file,
+        including when a looked up row turns out to hold another text
+    """
+
+    def __init__(self, path: str):
+        index_path = sidecar_path(path, INDEX_SUFFIX)
+        with open(index_path, "rb") as index_file:
+            header = index_file.read(_INDEX_HEADER.size)
+        if len(header) != _INDEX_HEADER.size:
+            raise ValueError(f"truncated index {index_path}")
+        (magic, key_width, row_count, csv_size, csv_mtime_ns) = _INDEX_HEADER.unpack(
+            header
+        )
+        if magic != _INDEX_MAGIC:
+            raise ValueError(
+                f"{index_path} is not a ner_positions index of this version, rewrite {path}"
+            )
+        csv_stat = os.stat(path)
+        if csv_size != csv_stat.st_size or csv_mtime_ns != csv_stat.st_mtime_ns:
+            raise ValueError(f"stale index {index_path}, {path} was modified")
+
+        self._index_path = index_path
+        self._key_width: int = key_width
+        self._csv_size: int = csv_size
+        if row_count == 0:
+            self._text_ids = numpy.empty(0, dtype=f"S{key_width}")
+            self._offsets = numpy.empty(0, dtype="<u8")
+        else:
+            self._text_ids = numpy.memmap(
+                index_path,
+                dtype=f"S{key_width}",
+                mode="r",
+                offset=_INDEX_HEADER.size,
+                shape=(row_count,),
+            )
+            self._offsets = numpy.memmap(
+                index_path,
+                dtype="<u8",
+                mode="r",
+                offset=_INDEX_HEADER.size + row_count * key_width,
+                shape=(row_count,),
+            )
+        self._file = open(path, "rb")
+
+    def _find(self, text_id: str) -> Optional[int]:
+        encoded_id = text_id.encode("utf-8")
+        if len(encoded_id) > self._key_width:
+            return None
+        row_idx = int(numpy.searchsorted(self._text_ids, encoded_id))
+        if row_idx < len(self._text_ids) and self._text_ids[row_idx] == encoded_id:
+            return row_idx
+        return None
+
+    def __len__(self) -> int:
+        return len(self._text_ids)
+
+    def __contains__(self, text_id: str) -> bool:
+        return self._find(text_id) is not None
+
+    def lookup_raw(self, text_id: str) -> Optional[str]:
+        """
+        Returns the unparsed `ner_positions` field of a text, or None if the text is absent.
+        """
+        row_idx = self._find(text_id)
+        if row_idx is None:
+            return None
+        row_start = int(self._offsets[row_idx])
+        row_end = (
+            int(self._offsets[row_idx + 1])
+            if row_idx + 1 < len(self._offsets)
+            else self._csv_size
+        )
+        self._file.seek(row_start)
+        row_text = self._file.read(row_end - row_start).decode("utf-8")
+        (row_text_id, ner_positions_raw) = next(
+            csv.reader(io.StringIO(row_text, newline=""))
+        )
+        # the size and time checks cannot catch every rewrite
+        if row_text_id != text_id:
+            raise ValueError(
+                f"stale index {self._index_path}, the row of {text_id} holds {row_text_id}"
+            )
+        return ner_positions_raw
+
+    def lookup(self, text_id: str) -> Optional[NerPositions]:
+        """
+        Returns the parsed `ner_positions` field of a text, or None if the text is absent.
+
+        :raises ValueError: if the row is malformed
+        """
+        ner_positions_raw = self.lookup_raw(text_id)
+        if ner_positions_raw is None:
+            return None
+        try:
+            ner_positions_maybe: Any = literal_eval(ner_positions_raw)
+        except (ValueError, SyntaxError):
+            raise ValueError(f"unparseable ner_position for {text_id}")
+        match _validate_ner_possition_format(ner_positions_maybe):
+            case None:
+                raise ValueError(f"ner_position has wrong shape for {text_id}")
+            case ner_positions:
+                return ner_positions
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def lookup_text(path: str, text_id: str) -> Optional[NerPositions]:
+    """
+    Fetches the tags of a single text from an indexed csv file, see `NerPositionsIndex`.
+    """
+    with NerPositionsIndex(path) as text_index:
+        return text_index.lookup(text_id)
+
+
+def fingerprint_df(input_df: pandas.DataFrame) -> dict[str, str]:
+    """
+    Computes a short fingerprint of the raw ner_positions field of every text, without parsing it.
+
+    Rows with a malformed sha512 or ner_positions are ignored.
+    """
+    result: dict[str, str] = dict()
+    for text_id, ner_positions_raw in input_df[["sha512", "ner_positions"]].itertuples(
+        index=False, name=None
+    ):
+        if isinstance(text_id, str) and isinstance(ner_positions_raw, str):
+            result[text_id] = hashlib.blake2b(
+                ner_positions_raw.encode("utf-8"), digest_size=16
+            ).hexdigest()
+    return result
+
+
+def file_fingerprint(path: str, *, chunksize: int = 1 << 20) -> str:
+    """
+    Computes a short fingerprint of a whole file (size and content digest),
+    used by sidecar files to tell whether they still describe it.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as input_file:
+        while chunk := input_file.read(chunksize):
+            digest.update(chunk)
+    return f"{os.path.getsize(path)}:{digest.hexdigest()}"
+
+
+@contextmanager
+def replaced_on_success(path: str) -> Iterator[str]:
+    """
+    Yields a temporary path to write instead of `path`, moved to `path` once the block completes.
+
+    If the block fails, the temporary file is removed and any previous file at `path` is left as it was.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        yield tmp_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def sidecar_path(path: str, suffix: str) -> str:
+    """
+    Names a file stored next to `path`.
+
+    Example: sidecar_path("merged.csv", ".fingerprints.csv") -> "merged.fingerprints.csv"
+    """
+    return os.path.splitext(path)[0] + suffix
+
+
+def remove_sidecars(path: str, *suffixes: str) -> None:
+    """
+    Removes the files stored next to `path` under the given suffixes when present,
+    e.g. once `path` is rewritten and they no longer describe it.
+    """
+    for suffix in suffixes:
+        file_path = sidecar_path(path, suffix)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def load_reference_texts(df: pandas.DataFrame) -> dict[str, str]:
+    """
+    Morphs a loaded DataFrame of source texts into a text id to text dictionary.
+
+    The DataFrame is expected to contain the following columns: sha512, description.
+    """
+    df = cast(pandas.DataFrame, df[["sha512", "description"]])
+    df = df.astype({"sha512": str, "description": str})
+    df = cast(pandas.DataFrame, df[df.notna().all(axis=1)])
+
+    return dict(df.itertuples(index=False, name=None))
+
+
+def read_reference_texts(
+    path: str, text_ids: Optional[Collection[str]] = None, *, chunksize: int = 16384
+) -> dict[str, str]:
+    """
+    Loads the source texts of a csv file (columns: sha512, description; `;` separated), `chunksize` rows at a time.
+
+    When `text_ids` is given only these texts are kept, so memory scales with the texts needed rather than with the file.
+    """
+    result: dict[str, str] = dict()
+    wanted = None if text_ids is None else set(text_ids)
+    with pandas.read_csv(
+        path,
+        sep=";",
+        encoding="utf-8-sig",
+        usecols=["sha512", "description"],
+        dtype=str,
+        chunksize=chunksize,
+    ) as reader:
+        for chunk in reader:
+            if wanted is not None:
+                chunk = chunk[chunk["sha512"].isin(wanted)]
+            result.update(load_reference_texts(chunk))
+    return result
+
+
+def match_word(reference_text: str, match_position: NerPositionsMatch) -> str:
+    """
+    Slices the word designated by a match out of its reference text.
+    """
+    return reference_text[match_position["char_start"] : match_position["char_end"]]
+
+
+def materialize_words(
+    text_dict: TextToNerPositions, reference_texts: dict[str, str]
+) -> TextToNerPositions:
+    """
+    Fills the `word` of every match from the reference texts.
+
+    Matches of texts missing from `reference_texts` are given an empty word.
+    The input is not mutated.
+    """
+    result: TextToNerPositions = dict()
+    for text_id, ner_positions in text_dict.items():
+        reference_text = reference_texts.get(text_id)
+        result[text_id] = dict(
+            (
+                tag,
+                [
+                    m
+                    | {
+                        "word": ""
+                        if reference_text is None
+                        else match_word(reference_text, m)
+                    }
+                    for m in match_list
+                ],
+            )
+            for (tag, match_list) in ner_positions.items()
+        )
+    return result
+
+
 # __all__ = ["df_to_dict", 'dict_to_df']
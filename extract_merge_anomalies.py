@@ -1,61 +1,33 @@
 #!/usr/bin/env -S uv run
 
-from pandas import pandas
 import dfio
-from merge_stats import (
-    NerPositionMatchSourced,
-    TextToNerPositionsSourced,
-    cast_text_to_ner_position_sourced,
-)
-from sys import exit, argv
+from merge_filter import MatchFilter, filter_csv
 from typing import cast
 
-
-def extract_merge_anomalies(
-    merged_data: TextToNerPositionsSourced,
-) -> TextToNerPositionsSourced:
-    result: TextToNerPositionsSourced = dict()
-    for text_id, tag_dict in merged_data.items():
-        result_tag_dict = result.setdefault(text_id, dict())
-        for tag_name, match_list in tag_dict.items():
-            result_match_list = result_tag_dict.setdefault(tag_name, [])
-            for tag_match in filter(lambda m: len(m["src"]) < 2, match_list):
-                result_match_list.append(tag_match)
-
-    return result
-
-
-def colapse_empty_tags(data: dict[str, list[NerPositionMatchSourced]]):
-    pair_list = list(data.items())
-    for k, v in pair_list:
-        if len(v) == 0:
-            del data[k]
-
-
-def collapse_empty_texts(merge_data: TextToNerPositionsSourced):
-    text_id_list = list(merge_data.items())
-    for k, v in text_id_list:
-        colapse_empty_tags(v)
-        if len(v) == 0:
-            del merge_data[k]
+# anomalies are the matches found by a single source
+ANOMALY_FILTER = MatchFilter(max_sources=1)
 
 
 if __name__ == "__main__":
-    if len(argv) != 3:
-        print(f"usage: {argv[0]} input.csv output.csv")
-        exit(1)
-
-    input_df = pandas.read_csv(argv[1])
-
-    input_dict = dfio.df_to_dict(input_df)
-    input_dict_cast = cast_text_to_ner_position_sourced(input_dict)
-    if input_dict_cast is None:
-        raise ValueError("input data does not contain a src field")
-
-    extracted = extract_merge_anomalies(input_dict_cast)
-
-    collapse_empty_texts(extracted)
-
-    output_df = dfio.dict_to_df(cast(dfio.TextToNerPositions, extracted))
-
-    output_df.to_csv(argv[2], index=False)
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path", metavar="input.csv")
+    parser.add_argument("output_path", metavar="output.csv")
+    parser.add_argument(
+        "--reference-texts",
+        metavar="reference_texts.csv",
+        help="fill in the matched words from these source texts",
+    )
+    args = parser.parse_args()
+
+    # rows are streamed, only texts holding anomalies are kept in memory
+    output_dict = cast(
+        dfio.TextToNerPositions, dict(filter_csv(args.input_path, ANOMALY_FILTER))
+    )
+    if args.reference_texts is not None:
+        output_dict = dfio.materialize_words(
+            output_dict, dfio.read_reference_texts(args.reference_texts, output_dict)
+        )
+
+    dfio.write_csv(output_dict, args.output_path)
@@ -0,0 +1,400 @@
+#!/usr/bin/env -S uv run
+"""
+On disk interval index over the spans of a merged output, for stabbing, overlap and containment queries.
+
+Spans of each text are sorted by start and augmented with an implicit interval tree (as in cgranges):
+the node at index i of level k holds the max end of its subtree, so queries run in logarithmic time plus the size of their output.
+All arrays are stored in a single file and memory mapped when the index is opened.
+
+Spans are half open: [char_start, char_end).
+"""
+
+import json
+import struct
+from typing import Iterator, NamedTuple, Optional, Self
+
+import numpy
+
+import dfio
+from merge_stats import cast_ner_position_sourced
+from sources import SrcMask
+
+INDEX_SUFFIX = ".intervals"
+_MAGIC = b"SPANIDX1"
+_HEADER_LEN = struct.Struct("<I")
+_ALIGN = 8
+
+# subtrees of at most 2^(_LEAF_LEVEL + 1) spans are scanned linearly
+_LEAF_LEVEL = 3
+
+
+class IntervalHit(NamedTuple):
+    tag: str
+    char_start: int
+    char_end: int
+    src: SrcMask
+
+
+class NestedSpan(NamedTuple):
+    text_id: str
+    inner: IntervalHit
+    outer: IntervalHit
+
+
+def _prepare_tree(ends: list[int]) -> tuple[list[int], int]:
+    """
+    Computes the max end of every implicit tree node over spans sorted by start.
+
+    Returns the augmented ends and the level of the root (-1 for no span).
+    """
+    span_count = len(ends)
+    max_ends = list(ends)
+    if span_count == 0:
+        return (max_ends, -1)
+
+    last_idx = (span_count - 1) & ~1
+    last_max = ends[last_idx]
+    level = 1
+    while (1 << level) <= span_count:
+        half = 1 << (level - 1)
+        for node in range((half << 1) - 1, span_count, half << 2):
+            left_max = max_ends[node - half]
+            right_max = max_ends[node + half] if node + half < span_count else last_max
+            max_ends[node] = max(ends[node], left_max, right_max)
+        last_idx = last_idx - half if (last_idx >> level) & 1 else last_idx + half
+        if last_idx < span_count and max_ends[last_idx] > last_max:
+            last_max = max_ends[last_idx]
+        level += 1
+    return (max_ends, level - 1)
+
+
+def build_index(merged_path: str, index_path: Optional[str] = None) -> str:
+    """
+    Builds the interval index of a merged csv file, by default next to it.
+
+    Returns the path of the index.
+    """
+    if index_path is None:
+        index_path = dfio.sidecar_path(merged_path, INDEX_SUFFIX)
+
+    text_spans: dict[str, list[tuple[int, int, int, SrcMask]]] = dict()
+    tag_codes: dict[str, int] = dict()
+    for text_id, ner_positions in dfio.iter_csv_rows(merged_path):
+        match cast_ner_position_sourced(ner_positions):
+            case None:
+                raise ValueError(f"text {text_id} is not merge data (no src)")
+            case tag_dict:
+                spans = text_spans.setdefault(text_id, [])
+                for tag, match_list in tag_dict.items():
+                    tag_code = tag_codes.setdefault(tag, len(tag_codes))
+                    spans.extend(
+                        (m["char_start"], m["char_end"], tag_code, m["src"])
+                        for m in match_list
+                    )
+
+    sorted_text_ids = sorted(text_spans.keys())
+    text_offsets = [0]
+    root_levels: list[int] = []
+    starts: list[int] = []
+    ends: list[int] = []
+    max_ends: list[int] = []
+    codes: list[int] = []
+    srcs: list[int] = []
+    for text_id in sorted_text_ids:
+        spans = sorted(text_spans[text_id])
+        text_ends = [end for (_, end, _, _) in spans]
+        (text_max_ends, root_level) = _prepare_tree(text_ends)
+        starts.extend(start for (start, _, _, _) in spans)
+        ends.extend(text_ends)
+        max_ends.extend(text_max_ends)
+        codes.extend(tag_code for (_, _, tag_code, _) in spans)
+        srcs.extend(src for (_, _, _, src) in spans)
+        root_levels.append(root_level)
+        text_offsets.append(len(starts))
+    text_spans = dict()
+
+    encoded_ids = [text_id.encode("utf-8") for text_id in sorted_text_ids]
+    encoded_tags = [tag.encode("utf-8") for tag in tag_codes.keys()]
+    arrays = {
+        "text_ids": numpy.array(
+            encoded_ids, dtype=f"S{max(1, max(map(len, encoded_ids), default=1))}"
+        ),
+        "text_offsets": numpy.array(text_offsets, dtype="<i8"),
+        "root_levels": numpy.array(root_levels, dtype="<i4"),
+        "starts": numpy.array(starts, dtype="<i8"),
+        "ends": numpy.array(ends, dtype="<i8"),
+        "max_ends": numpy.array(max_ends, dtype="<i8"),
+        "tag_codes": numpy.array(codes, dtype="<i4"),
+        "srcs": numpy.array(srcs, dtype="<i8"),
+        "tags": numpy.array(
+            encoded_tags, dtype=f"S{max(1, max(map(len, encoded_tags), default=1))}"
+        ),
+    }
+    _write_arrays(index_path, arrays)
+    return index_path
+
+
+def _write_arrays(path: str, arrays: dict[str, numpy.ndarray]) -> None:
+    # header: magic, json length, json description of every array (offset, dtype, shape)
+    layout: dict[str, tuple[int, str, int]] = dict()
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = (offset, array.dtype.str, len(array))
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps(layout).encode("utf-8")
+    data_start = -(-(len(_MAGIC) + _HEADER_LEN.size + len(header)) // _ALIGN) * _ALIGN
+
+    with open(path, "wb") as index_file:
+        index_file.write(_MAGIC + _HEADER_LEN.pack(len(header)) + header)
+        for name, array in arrays.items():
+            index_file.seek(data_start + layout[name][0])
+            index_file.write(array.tobytes())
+        index_file.truncate(data_start + offset)
+
+
+class IntervalIndex:
+    """
+    Query API over an index written by `build_index`, meant to be used as a context manager.
+
+    :raises ValueError: if the file is not an interval index
+    """
+
+    def __init__(self, index_path: str):
+        with open(index_path, "rb") as index_file:
+            if index_file.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{index_path} is not an interval index")
+            (header_len,) = _HEADER_LEN.unpack(index_file.read(_HEADER_LEN.size))
+            layout = json.loads(index_file.read(header_len).decode("utf-8"))
+        data_start = (
+            -(-(len(_MAGIC) + _HEADER_LEN.size + header_len) // _ALIGN) * _ALIGN
+        )
+
+        self._arrays: dict[str, numpy.ndarray] = dict()
+        for name, (offset, dtype, length) in layout.items():
+            if length == 0:
+                self._arrays[name] = numpy.empty(0, dtype=dtype)
+            else:
+                self._arrays[name] = numpy.memmap(
+                    index_path,
+                    dtype=dtype,
+                    mode="r",
+                    offset=data_start + offset,
+                    shape=(length,),
+                )
+        self._text_ids = self._arrays["text_ids"]
+        self._text_offsets = self._arrays["text_offsets"]
+        self._root_levels = self._arrays["root_levels"]
+        self._starts = self._arrays["starts"]
+        self._ends = self._arrays["ends"]
+        self._max_ends = self._arrays["max_ends"]
+        self._tag_codes = self._arrays["tag_codes"]
+        self._srcs = self._arrays["srcs"]
+        self._tags = [tag.decode("utf-8") for tag in self._arrays["tags"].tolist()]
+
+    def text_ids(self) -> Iterator[str]:
+        return (text_id.decode("utf-8") for text_id in self._text_ids.tolist())
+
+    def _text_idx(self, text_id: str) -> Optional[int]:
+        encoded_id = text_id.encode("utf-8")
+        if len(encoded_id) > self._text_ids.dtype.itemsize:
+            return None
+        text_idx = int(numpy.searchsorted(self._text_ids, encoded_id))
+        if text_idx < len(self._text_ids) and self._text_ids[text_idx] == encoded_id:
+            return text_idx
+        return None
+
+    def _hit(self, span_idx: int) -> IntervalHit:
+        return IntervalHit(
+            self._tags[int(self._tag_codes[span_idx])],
+            int(self._starts[span_idx]),
+            int(self._ends[span_idx]),
+            int(self._srcs[span_idx]),
+        )
+
+    def _overlap_indexes(self, text_idx: int, start: int, end: int) -> list[int]:
+        """
+        Lists the span indexes of a text overlapping [start, end), in start order.
+        """
+        offset = int(self._text_offsets[text_idx])
+        span_count = int(self._text_offsets[text_idx + 1]) - offset
+        root_level = int(self._root_levels[text_idx])
+        starts, ends, max_ends = self._starts, self._ends, self._max_ends
+
+        result: list[int] = []
+        if root_level < 0:
+            return result
+        # (node, level, left child visited)
+        stack: list[tuple[int, int, bool]] = [
+            ((1 << root_level) - 1, root_level, False)
+        ]
+        while stack:
+            (node, level, left_done) = stack.pop()
+            if level <= _LEAF_LEVEL:
+                first = node >> level << level
+                last = min(first + (1 << (level + 1)) - 1, span_count)
+                for idx in range(first, last):
+                    if starts[offset + idx] >= end:
+                        break
+                    if start < ends[offset + idx]:
+                        result.append(offset + idx)
+            elif not left_done:
+                left = node - (1 << (level - 1))
+                stack.append((node, level, True))
+                if left >= span_count or max_ends[offset + left] > start:
+                    stack.append((left, level - 1, False))
+            elif node < span_count and starts[offset + node] < end:
+                if start < ends[offset + node]:
+                    result.append(offset + node)
+                stack.append((node + (1 << (level - 1)), level - 1, False))
+        return result
+
+    def overlapping(self, text_id: str, start: int, end: int) -> list[IntervalHit]:
+        """
+        Spans of a text overlapping [start, end), in start order.
+        """
+        text_idx = self._text_idx(text_id)
+        if text_idx is None:
+            return []
+        return [self._hit(i) for i in self._overlap_indexes(text_idx, start, end)]
+
+    def stabbing(self, text_id: str, position: int) -> list[IntervalHit]:
+        """
+        Spans of a text covering a character position.
+        """
+        return self.overlapping(text_id, position, position + 1)
+
+    def contained(self, text_id: str, start: int, end: int) -> list[IntervalHit]:
+        """
+        Spans of a text lying within [start, end).
+        """
+        text_idx = self._text_idx(text_id)
+        if text_idx is None:
+            return []
+        offset = int(self._text_offsets[text_idx])
+        span_count = int(self._text_offsets[text_idx + 1]) - offset
+        starts = self._starts[offset : offset + span_count]
+        first = int(numpy.searchsorted(starts, start, side="left"))
+        last = int(numpy.searchsorted(starts, end, side="left"))
+        return [
+            self._hit(offset + idx)
+            for idx in range(first, last)
+            if self._ends[offset + idx] <= end
+        ]
+
+    def containing(self, text_id: str, start: int, end: int) -> list[IntervalHit]:
+        """
+        Spans of a text enclosing [start, end).
+        """
+        text_idx = self._text_idx(text_id)
+        if text_idx is None:
+            return []
+        return [
+            self._hit(i)
+            for i in self._overlap_indexes(text_idx, start, max(end, start + 1))
+            if self._starts[i] <= start and self._ends[i] >= end
+        ]
+
+    def nested(self, tag: str, outer_tag: Optional[str] = None) -> Iterator[NestedSpan]:
+        """
+        Lists the spans of `tag` lying within a span of another tag (of `outer_tag` only, when given).
+        """
+        if tag not in self._tags:
+            return
+        tag_code = self._tags.index(tag)
+        for text_idx, text_id in enumerate(self.text_ids()):
+            offset = int(self._text_offsets[text_idx])
+            next_offset = int(self._text_offsets[text_idx + 1])
+            for inner_idx in range(offset, next_offset):
+                if self._tag_codes[inner_idx] != tag_code:
+                    continue
+                inner_start = int(self._starts[inner_idx])
+                inner_end = int(self._ends[inner_idx])
+                for outer_idx in self._overlap_indexes(
+                    text_idx, inner_start, max(inner_end, inner_start + 1)
+                ):
+                    outer = self._hit(outer_idx)
+                    if (
+                        outer.tag != tag
+                        and (outer_tag is None or outer.tag == outer_tag)
+                        and outer.char_start <= inner_start
+                        and outer.char_end >= inner_end
+                    ):
+                        yield NestedSpan(text_id, self._hit(inner_idx), outer)
+
+    def close(self) -> None:
+        self._arrays = dict()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+    import sys
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="index a merged csv file")
+    build_parser.add_argument("merged_path", metavar="merged.csv")
+    build_parser.add_argument(
+        "index_path", nargs="?", metavar="index", help="default: merged.intervals"
+    )
+
+    for command, help_text in (
+        ("overlap", "spans overlapping [start, end)"),
+        ("contained", "spans within [start, end)"),
+        ("containing", "spans enclosing [start, end)"),
+    ):
+        range_parser = commands.add_parser(command, help=help_text)
+        range_parser.add_argument("index_path", metavar="index")
+        range_parser.add_argument("text_id", metavar="sha512")
+        range_parser.add_argument("start", type=int)
+        range_parser.add_argument("end", type=int)
+
+    stab_parser = commands.add_parser("stab", help="spans covering a position")
+    stab_parser.add_argument("index_path", metavar="index")
+    stab_parser.add_argument("text_id", metavar="sha512")
+    stab_parser.add_argument("position", type=int)
+
+    nested_parser = commands.add_parser(
+        "nested", help="spans of a tag lying within a span of another tag"
+    )
+    nested_parser.add_argument("index_path", metavar="index")
+    nested_parser.add_argument("tag")
+    nested_parser.add_argument("--outer-tag")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.merged_path, args.index_path)
+        sys.exit(0)
+
+    writer = csv.writer(sys.stdout)
+    with IntervalIndex(args.index_path) as interval_index:
+        match args.command:
+            case "nested":
+                writer.writerow(
+                    ["text_id", "tag", "char_start", "char_end", "src"]
+                    + ["outer_tag", "outer_char_start", "outer_char_end", "outer_src"]
+                )
+                for nested_span in interval_index.nested(args.tag, args.outer_tag):
+                    writer.writerow(
+                        [nested_span.text_id, *nested_span.inner, *nested_span.outer]
+                    )
+            case command:
+                if command == "stab":
+                    hits = interval_index.stabbing(args.text_id, args.position)
+                else:
+                    query = {
+                        "overlap": interval_index.overlapping,
+                        "contained": interval_index.contained,
+                        "containing": interval_index.containing,
+                    }[command]
+                    hits = query(args.text_id, args.start, args.end)
+                writer.writerow(["tag", "char_start", "char_end", "src"])
+                writer.writerows(hits)
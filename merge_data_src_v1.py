@@ -1,120 +1,90 @@
 #!/usr/bin/env python3
 
 import pandas
-import ast
 import sys
 import itertools
 import typing
 
+import dfio
+from sources import SrcMask, source_bit
+
 Pos = tuple[int, int, str]
 
-PosSrcDict = dict[Pos, set[str]]  # Position to source material
+PosSrcDict = dict[Pos, SrcMask]  # Position to source material mask (see sources.py)
 LabelPosDict = dict[str, PosSrcDict]
 TextLabelDict = dict[str, LabelPosDict]
 
-T = typing.TypeVar("T")
-U = typing.TypeVar("U")
-
 
-def df_to_dict(df: pandas.DataFrame, src_name: str) -> TextLabelDict:
+def malformed_labels(
+    df: pandas.DataFrame, err_idx: typing.Iterable[int]
+) -> typing.Iterator[tuple[str, dfio.NerPositions]]:
     """
-    Extracts data from a DataFrame to a dictionary for further processing
+    Stands for the malformed rows of `df` (indexes reported by `dfio.iter_df_rows`) with no labels.
     """
-    text_dict: TextLabelDict = dict()
-    for _, row in df.iterrows():
-        text_key = str(row["sha512"])
-        label_dict: LabelPosDict = text_dict.setdefault(text_key, dict())
-        try:
-            df_labels: dict[str, list[dict]] = ast.literal_eval(
-                str(row["ner_positions"])
-            )
-            df_labels_flattened = flatten_df_labels(df_labels, src_name)
-        except:  # noqa: E722 permet d'ignorer les lignes malformatees
-            continue
-
-        merged = merge_tag_set(label_dict, df_labels_flattened)
-
-        text_dict[text_key] = merged
-
-    return text_dict
+    for idx in err_idx:
+        yield (str(df.at[idx, "sha512"]), dict())
 
 
-def flatten_df_labels(df_labels: dict[str, list[dict]], src_name: str) -> LabelPosDict:
+def iter_df_labels(
+    df: pandas.DataFrame,
+) -> typing.Iterator[tuple[str, dfio.NerPositions]]:
     """
-    Formats a dict compatible with the `ner_positions` field to a label ditionary including position and source traceability
+    Parses the `ner_positions` field of every row with the shared dfio loader.
+
+    Malformed rows are yielded last, with no labels, so their text still appears in the output.
     """
-    result = dict()
-    for k, v in df_labels.items():
-        pos_list: PosSrcDict = dict(
-            map(
-                lambda x: (
-                    (int(x["char_start"]), int(x["char_end"]), str(x["word"])),
-                    {src_name},
-                ),
-                v,
-            )
-        )
-        result[k] = pos_list
-    return result
+    err_idx: list[int] = []
+    yield from dfio.iter_df_rows(df, err_idx=err_idx)
+    yield from malformed_labels(df, err_idx)
 
 
-def get_or(input_dict: dict[T, U], key: T, default: U) -> U:
-    """
-    Returns the value corresponding to `key` in `input_dict` or `default` if key is not present in `input_dict`.
-    `input_dict` is not modified
+def accumulate_labels(
+    text_dict: TextLabelDict,
+    rows: typing.Iterable[tuple[str, dfio.NerPositions]],
+    src_name: str,
+) -> TextLabelDict:
     """
-    if key in input_dict:
-        return input_dict[key]
-    else:
-        return default
+    Adds parsed `ner_positions` fields to `text_dict` in place, tagging every position with the bit of `src_name`.
+
+    Rows sharing a text, from this source or from sources accumulated earlier, are merged as they are read.
+    Returns `text_dict`.
+    """
+    src_bit = source_bit(src_name)
+    for text_key, df_labels in rows:
+        label_dict = text_dict.setdefault(text_key, dict())
+        for tag, match_list in df_labels.items():
+            pos_dict = label_dict.setdefault(tag, dict())
+            for match in match_list:
+                pos: Pos = (
+                    int(match["char_start"]),
+                    int(match["char_end"]),
+                    str(match.get("word", "")),
+                )
+                pos_dict[pos] = pos_dict.get(pos, 0) | src_bit
+    return text_dict
 
 
-def merge_tag_set(tag_set_a: LabelPosDict, tag_set_b: LabelPosDict) -> LabelPosDict:
+def df_to_dict(df: pandas.DataFrame, src_name: str) -> TextLabelDict:
     """
-    Merges two LabelPosDict together such that the returned LabelPosDict contains the merged position of every label with their respective source traceability
+    Extracts data from a DataFrame to a dictionary for further processing
     """
-    merged: LabelPosDict = dict()
-
-    for tag in set(itertools.chain(tag_set_a.keys(), tag_set_b.keys())):
-        pos_source_a = get_or(tag_set_a, tag, dict())
-        pos_source_b = get_or(tag_set_b, tag, dict())
-
-        def merge_ab_src(pos: Pos) -> tuple[Pos, set[str]]:
-            return (
-                pos,
-                get_or(pos_source_a, pos, set()) | get_or(pos_source_b, pos, set()),
-            )
-
-        pos = set(itertools.chain(pos_source_a.keys(), pos_source_b.keys()))
-        merged_pos: PosSrcDict = dict(map(merge_ab_src, pos))
-        merged[tag] = merged_pos
-
-    return merged
+    return accumulate_labels(dict(), iter_df_labels(df), src_name)
 
 
 def merge_datasource(
     df1: pandas.DataFrame,
     df2: pandas.DataFrame,
-    source_name_1: str = "A",
-    source_name_2: str = "B",
+    source_name_1: str = "ner",
+    source_name_2: str = "onet",
 ) -> TextLabelDict:
     """
     merges two tables of texts and ner_positions such that the result is one deduplicated set of texts and ner_positions.
     A traceability `src` tag will be added for each tag match to indicate which source table it came from.
-    This tag will be a list of the sources' name
+    This tag will be a mask of the sources (see sources.py)
     """
-    dict1 = df_to_dict(df1, source_name_1)
-    dict2 = df_to_dict(df2, source_name_2)
-
     merged: TextLabelDict = dict()
-
-    for text in set(itertools.chain(dict1.keys(), dict2.keys())):
-        tag_set_a = get_or(dict1, text, dict())
-        tag_set_b = get_or(dict2, text, dict())
-
-        merged_tags = merge_tag_set(tag_set_a, tag_set_b)
-        merged[text] = merged_tags
-
+    accumulate_labels(merged, iter_df_labels(df1), source_name_1)
+    accumulate_labels(merged, iter_df_labels(df2), source_name_2)
     return merged
 
 
@@ -129,7 +99,7 @@ def map_pos_dict(pos_dict: PosSrcDict) -> typing.Iterable[dict]:
             "char_start": x[0][0],
             "char_end": x[0][1],
             "word": x[0][2],
-            "src": list(x[1]),
+            "src": x[1],
         },
         pos_dict.items(),
     )
@@ -142,13 +112,25 @@ def map_label_pos_dict(label_dict: LabelPosDict) -> dict[str, list[dict]]:
     return dict(map(lambda x: (x[0], list(map_pos_dict(x[1]))), label_dict.items()))
 
 
+def label_dict_to_text_dict(
+    dict_data: TextLabelDict,
+) -> dict[str, dict[str, list[dict]]]:
+    """
+    Maps the resulting TextLabelDict to the text to `ner_positions` format written by `dfio.write_csv`.
+    """
+    return dict(
+        (text_key, map_label_pos_dict(label_dict))
+        for (text_key, label_dict) in dict_data.items()
+    )
+
+
 def dict_to_df(
     dict_data: TextLabelDict,
 ) -> pandas.DataFrame:
     """
-    Morphs the resulting TextLabelDict to a DataFrame suitable as output.
+    Morphs the resulting TextLabelDict to a DataFrame suitable as output, rows are sorted by sha512.
     """
-    raw_items_1, raw_items_2 = itertools.tee(dict_data.items())
+    raw_items_1, raw_items_2 = itertools.tee(sorted(dict_data.items()))
 
     sha_data = map(lambda x: x[0], raw_items_1)
     tag_data = map(lambda x: x[1], raw_items_2)
@@ -171,5 +153,7 @@ if __name__ == "__main__":
     df2 = pandas.read_csv(file2)
 
     merged_dict = merge_datasource(df1, df2, "ner", "onet")
-    merged_df = dict_to_df(merged_dict)
-    merged_df.to_csv(outfile, index=False)
+    dfio.write_csv(
+        typing.cast(dfio.TextToNerPositions, label_dict_to_text_dict(merged_dict)),
+        outfile,
+    )
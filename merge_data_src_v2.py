@@ -1,125 +1,559 @@
 #!/usr/bin/env -S uv run
 
+import csv
+import pandas
+
 import dfio
-from merge_stats import NerPositionMatchSourced, TextToNerPositionsSourced
-from typing import TypeVar, cast
+from span_algebra import merge_many_span_sources, sort_spans
+from merge_stats import (
+    NerPositionMatchSourced,
+    NerPositionsSourced,
+    TagSourceStatistic,
+    TextToNerPositionsSourced,
+)
+from sources import SOURCE_NAMES, SrcMask, source_bit
+from collision_stats import CollisionStatistic, parse_merged_rows
+from tag_match_analysis import (
+    OVERLAP_DATASET_COLUMNS,
+    TagOverlap,
+    get_merged_text_overlaps,
+    text_overlap_rows,
+    text_overlaps_to_dataset,
+)
+from heapq import merge as heap_merge
+from contextlib import ExitStack
+from itertools import chain, groupby
+from operator import itemgetter
+from typing import Iterable, Iterator, Mapping, Optional, Protocol, cast
+
+# kinds of text changes reported by diff_fingerprints
+TEXT_ADDED = "added"
+TEXT_REMOVED = "removed"
+TEXT_MODIFIED = "modified"
+
+SourceFingerprints = dict[str, dict[str, str]]  # source name -> sha512 -> fingerprint
 
-_T = TypeVar("_T")
 
+class MergeAccumulator(Protocol):
+    """
+    Receives every text as soon as it is merged, e.g. `merge_stats.TagSourceStatistic`.
+    """
 
-def _get_or(input_dict: dict[str, _T], key: str, default_val: _T) -> _T:
-    try:
-        return input_dict[key]
-    except KeyError:
-        return default_val
+    def account_text(self, text_id: str, tag_dict: NerPositionsSourced) -> None: ...
 
 
 def _mk_tuple(pos_match: dfio.NerPositionsMatch) -> tuple[int, int]:
     return (pos_match["char_start"], pos_match["char_end"])
 
 
-def _mk_pos_match(
-    pos_tuple: tuple[int, int], src_list: list[str]
-) -> NerPositionMatchSourced:
+def _mk_pos_match(pos_tuple: tuple[int, int], src: SrcMask) -> NerPositionMatchSourced:
     return {
         "char_start": pos_tuple[0],
         "char_end": pos_tuple[1],
         "word": "",
-        "src": src_list,
+        "src": src,
     }
 
 
-def _merge_match_list(
-    match_list_a: list[dfio.NerPositionsMatch],
-    match_list_b: list[dfio.NerPositionsMatch],
-    src_name_a: str,
-    src_name_b: str,
+def _merge_match_lists(
+    match_lists: list[list[dfio.NerPositionsMatch]],
+    src_names: list[str],
 ) -> list[NerPositionMatchSourced]:
-    match_set_a = set(_mk_tuple(m) for m in match_list_a)
-    match_set_b = set(_mk_tuple(m) for m in match_list_b)
+    span_lists = [
+        sort_spans(_mk_tuple(m) for m in match_list) for match_list in match_lists
+    ]
 
-    set_intersect = match_set_a & match_set_b
+    src_bits = [source_bit(src_name) for src_name in src_names]
+
+    result: list[NerPositionMatchSourced] = []
+    for span, membership in merge_many_span_sources(span_lists):
+        src_mask = 0
+        for src_idx, src_bit in enumerate(src_bits):
+            if membership & (1 << src_idx):
+                src_mask |= src_bit
+        result.append(_mk_pos_match(span, src_mask))
+
+    return result
+
+
+def merge_text_sources(
+    text_sources: list[tuple[str, dfio.NerPositions]],
+) -> NerPositionsSourced:
+    """
+    Merges the tags found for a single text by several named sources.
 
-    result: list[NerPositionMatchSourced] = [
-        _mk_pos_match(m, [src_name_a, src_name_b]) for m in set_intersect
+    Each tag is merged in a single pass over the sources where it appears.
+    Each tag is given the mask of the sources where it was found.
+    Source names must be registered in `sources.SOURCE_NAMES`.
+    """
+    result: NerPositionsSourced = dict()
+    # tags are merged in order of first appearance so the output does not depend on hashing
+    all_tags = dict.fromkeys(
+        chain.from_iterable(tag_dict.keys() for (_, tag_dict) in text_sources)
+    )
+
+    for tag_name in all_tags:
+        tagged_sources = [
+            (src_name, tag_dict[tag_name])
+            for (src_name, tag_dict) in text_sources
+            if tag_name in tag_dict
+        ]
+        result[tag_name] = _merge_match_lists(
+            [match_list for (_, match_list) in tagged_sources],
+            [src_name for (src_name, _) in tagged_sources],
+        )
+
+    return result
+
+
+def merge_many_text_bodies(
+    text_bodies: Mapping[str, dfio.TextToNerPositions],
+    accumulator: Optional[MergeAccumulator] = None,
+) -> TextToNerPositionsSourced:
+    """
+    Merges any number of named bodies of texts with tags into a single body of text with tags.
+
+    Each tag is given the mask of the sources where it was found.
+    Source names must be registered in `sources.SOURCE_NAMES`.
+    Texts are merged in sha512 order, each merged text is passed to `accumulator` when given.
+    """
+    result: TextToNerPositionsSourced = dict()
+    all_text_ids: set[str] = set()
+    for text_body in text_bodies.values():
+        all_text_ids.update(text_body.keys())
+
+    for text_id in sorted(all_text_ids):
+        result[text_id] = merge_text_sources(
+            [
+                (src_name, text_body[text_id])
+                for (src_name, text_body) in text_bodies.items()
+                if text_id in text_body
+            ]
+        )
+        if accumulator is not None:
+            accumulator.account_text(text_id, result[text_id])
+
+    return result
+
+
+def _check_sorted_rows(
+    rows: Iterable[tuple[str, dfio.NerPositions]], src_idx: int, src_name: str
+) -> Iterator[tuple[str, int, dfio.NerPositions]]:
+    previous_text_id: Optional[str] = None
+    for text_id, ner_positions in rows:
+        if previous_text_id is not None and text_id <= previous_text_id:
+            problem = "duplicate" if text_id == previous_text_id else "out of order"
+            raise ValueError(
+                f'input "{src_name}" is not strictly sorted by sha512: {problem} sha512 {text_id} after {previous_text_id}'
+            )
+        previous_text_id = text_id
+        yield (text_id, src_idx, ner_positions)
+
+
+def stream_merge_text_bodies(
+    text_streams: Mapping[str, Iterable[tuple[str, dfio.NerPositions]]],
+    accumulator: Optional[MergeAccumulator] = None,
+) -> Iterator[tuple[str, NerPositionsSourced]]:
+    """
+    Merges named streams of (sha512, tags) rows sorted by sha512, one text at a time.
+
+    The streams are read in lockstep and merged texts are yielded in sha512 order as soon as they are complete,
+    so only the current text of each stream is held in memory.
+    Each merged text is passed to `accumulator` when given.
+
+    :raises ValueError: when a stream is not strictly sorted by sha512
+    """
+    checked_streams = [
+        _check_sorted_rows(rows, src_idx, src_name)
+        for (src_idx, (src_name, rows)) in enumerate(text_streams.items())
     ]
+    src_names = list(text_streams.keys())
 
-    for match_in_a in (
-        _mk_pos_match(m, [src_name_a]) for m in (match_set_a - set_intersect)
+    for text_id, text_rows in groupby(
+        heap_merge(*checked_streams, key=itemgetter(0)), key=itemgetter(0)
     ):
-        result.append(match_in_a)
+        merged_tags = merge_text_sources(
+            [
+                (src_names[src_idx], ner_positions)
+                for (_, src_idx, ner_positions) in text_rows
+            ]
+        )
+        if accumulator is not None:
+            accumulator.account_text(text_id, merged_tags)
+        yield (text_id, merged_tags)
 
-    for match_in_b in (
-        _mk_pos_match(m, [src_name_b]) for m in (match_set_b - set_intersect)
-    ):
-        result.append(match_in_b)
 
+def diff_fingerprints(
+    previous: SourceFingerprints, current: SourceFingerprints
+) -> dict[str, str]:
+    """
+    Lists the texts whose tags were added, removed or modified in any source between two runs.
+
+    Returns a sha512 to change kind (`TEXT_ADDED`, `TEXT_REMOVED` or `TEXT_MODIFIED`) dictionary.
+    """
+    src_names = list(dict.fromkeys(chain(previous.keys(), current.keys())))
+    all_text_ids: set[str] = set()
+    for fingerprints in chain(previous.values(), current.values()):
+        all_text_ids.update(fingerprints.keys())
+
+    result: dict[str, str] = dict()
+    for text_id in all_text_ids:
+        before = [previous.get(src_name, {}).get(text_id) for src_name in src_names]
+        after = [current.get(src_name, {}).get(text_id) for src_name in src_names]
+        if before == after:
+            continue
+        if all(fingerprint is None for fingerprint in before):
+            result[text_id] = TEXT_ADDED
+        elif all(fingerprint is None for fingerprint in after):
+            result[text_id] = TEXT_REMOVED
+        else:
+            result[text_id] = TEXT_MODIFIED
     return result
 
 
+def splice_merged_rows(
+    previous_rows: dict[str, str],
+    changed_rows: dict[str, str],
+    changes: dict[str, str],
+) -> dict[str, str]:
+    """
+    Replaces the changed texts of a previous merged output with their freshly merged rows.
+
+    Rows are raw `ner_positions` fields. Unchanged rows are kept as is, the result is sorted by sha512.
+    Changed texts without a freshly merged row are dropped.
+    """
+    result = dict(previous_rows)
+    for text_id in changes.keys():
+        if text_id in changed_rows:
+            result[text_id] = changed_rows[text_id]
+        else:
+            result.pop(text_id, None)
+    return dict(sorted(result.items(), key=itemgetter(0)))
+
+
+# column of the fingerprints file recording the offsets-only mode of the output they describe
+OFFSETS_ONLY_COLUMN = "offsets_only"
+
+
+def load_fingerprints(path: str) -> tuple[SourceFingerprints, Optional[bool]]:
+    """
+    Loads fingerprints written by `fingerprints_to_df`,
+    with the offsets-only mode of the output they describe (None when it is not recorded).
+    """
+    df = pandas.read_csv(path, dtype=str)
+    offsets_only = None
+    if OFFSETS_ONLY_COLUMN in df.columns and len(df) > 0:
+        offsets_only = df[OFFSETS_ONLY_COLUMN].iat[0] == str(True)
+    fingerprints = dict(
+        (
+            src_name,
+            dict(
+                (text_id, fingerprint)
+                for (text_id, fingerprint) in zip(df["sha512"], df[src_name])
+                if isinstance(fingerprint, str)
+            ),
+        )
+        for src_name in df.columns
+        if src_name not in ("sha512", OFFSETS_ONLY_COLUMN)
+    )
+    return (fingerprints, offsets_only)
+
+
+def fingerprints_to_df(
+    fingerprints: SourceFingerprints, offsets_only: bool
+) -> pandas.DataFrame:
+    all_text_ids: set[str] = set()
+    for src_fingerprints in fingerprints.values():
+        all_text_ids.update(src_fingerprints.keys())
+    sorted_text_ids = sorted(all_text_ids)
+
+    columns: dict[str, list[str]] = {"sha512": sorted_text_ids}
+    for src_name, src_fingerprints in fingerprints.items():
+        columns[src_name] = [src_fingerprints.get(t, "") for t in sorted_text_ids]
+    columns[OFFSETS_ONLY_COLUMN] = [str(offsets_only)] * len(sorted_text_ids)
+    return pandas.DataFrame(columns)
+
+
+def change_log_to_df(changes: dict[str, str]) -> pandas.DataFrame:
+    sorted_changes = sorted(changes.items())
+    return pandas.DataFrame(
+        {
+            "sha512": [text_id for (text_id, _) in sorted_changes],
+            "change": [change for (_, change) in sorted_changes],
+        }
+    )
+
+
 def merge_text_bodies(
     text_body_a: dfio.TextToNerPositions,
     text_body_b: dfio.TextToNerPositions,
     body_name_a: str,
     body_name_b: str,
+    accumulator: Optional[MergeAccumulator] = None,
 ) -> TextToNerPositionsSourced:
     """
     Merges two bodies of texts with tags into  single body of text with tags.
 
-    Each tag is given a list of sources where it wa found
+    Each tag is given a mask of the sources where it wa found
+    Each merged text is passed to `accumulator` when given (see `MergeAccumulator`).
     """
-    result: TextToNerPositionsSourced = dict()
-    all_text_ids: set[str] = set(text_body_a.keys()) | set(text_body_b.keys())
-    for text_id in all_text_ids:
-        tag_dict_result = result.setdefault(text_id, dict())
-        tag_dict_a = _get_or(text_body_a, text_id, dict())
-        tag_dict_b = _get_or(text_body_b, text_id, dict())
-        all_tags: set[str] = set(tag_dict_a.keys()) | set(tag_dict_b.keys())
-        for tag_name in all_tags:
-            match_list_a = _get_or(tag_dict_a, tag_name, [])
-            match_list_b = _get_or(tag_dict_b, tag_name, [])
-            tag_dict_result[tag_name] = _merge_match_list(
-                match_list_a, match_list_b, body_name_a, body_name_b
+    return merge_many_text_bodies(
+        {body_name_a: text_body_a, body_name_b: text_body_b}, accumulator
+    )
+
+
+__all__ = [
+    "MergeAccumulator",
+    "merge_text_bodies",
+    "merge_many_text_bodies",
+    "merge_text_sources",
+    "stream_merge_text_bodies",
+    "diff_fingerprints",
+    "splice_merged_rows",
+]
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "input_paths",
+        nargs="+",
+        metavar="input.csv",
+        help="sources to merge, by default a NER input then a tagger input",
+    )
+    parser.add_argument("output_path", metavar="output.csv")
+    parser.add_argument(
+        "--names",
+        help="comma separated source names, one per input (default: ner,tagger)",
+    )
+    parser.add_argument(
+        "--offsets-only",
+        action="store_true",
+        help="only write match offsets, words are left out",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="read inputs sorted by sha512 in lockstep and write each merged text immediately",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only recompute the texts that changed since the previous run on the same output, changes are logged next to the output",
+    )
+    parser.add_argument(
+        "--collision-stats",
+        action="store_true",
+        help="maintain per tag collision statistics next to the output, updated from the changed texts only with --incremental",
+    )
+    parser.add_argument(
+        "--overlaps",
+        metavar="colision_list.csv",
+        help="also write the cross tag overlaps of the merged texts, as tag_match_analysis.py would",
+    )
+    args = parser.parse_args()
+
+    if args.streaming and args.incremental:
+        parser.error("--streaming and --incremental are mutually exclusive")
+    if args.overlaps is not None and args.incremental:
+        parser.error("--overlaps cannot be used with --incremental")
+
+    src_names: list[str] = (
+        ["ner", "tagger"] if args.names is None else args.names.split(",")
+    )
+    if len(src_names) != len(args.input_paths):
+        parser.error(f"{len(args.input_paths)} inputs but {len(src_names)} names")
+    if len(set(src_names)) != len(src_names):
+        parser.error("source names must be unique")
+    for src_name in src_names:
+        if src_name not in SOURCE_NAMES:
+            parser.error(f'unknown source "{src_name}", see sources.SOURCE_NAMES')
+
+    # cross tag overlaps of the merged texts, per text (streaming merges write them as they go)
+    text_overlaps: dict[str, list[TagOverlap]] = dict()
+    # statistics accounted while merging, written next to the output
+    stats_path = dfio.sidecar_path(args.output_path, ".stats.csv")
+    merge_stats = TagSourceStatistic()
+    # collision statistics, kept next to the output
+    collision_stats_path = dfio.sidecar_path(args.output_path, ".collision_stats.csv")
+    collision_stats = CollisionStatistic()
+
+    if args.streaming:
+        # inputs are read lazily, at most one text per input is held in memory
+        text_streams = dict(
+            (src_name, dfio.iter_csv_rows(input_path))
+            for (src_name, input_path) in zip(src_names, args.input_paths)
+        )
+        with ExitStack() as output_files:
+            writer = output_files.enter_context(
+                dfio.NerPositionsWriter(
+                    args.output_path, offsets_only=args.offsets_only
+                )
             )
+            # overlaps are written as each text is merged, not kept until the end
+            overlaps_writer = None
+            if args.overlaps is not None:
+                # like the merged output, the overlaps only replace a previous file once complete
+                overlaps_tmp_path = output_files.enter_context(
+                    dfio.replaced_on_success(args.overlaps)
+                )
+                overlaps_writer = csv.writer(
+                    output_files.enter_context(
+                        open(overlaps_tmp_path, "w", newline="", encoding="utf-8")
+                    ),
+                    lineterminator="\n",
+                )
+                overlaps_writer.writerow(OVERLAP_DATASET_COLUMNS)
+            for text_id, merged_tags in stream_merge_text_bodies(
+                text_streams, merge_stats
+            ):
+                writer.write(text_id, cast(dfio.NerPositions, merged_tags))
+                if args.collision_stats:
+                    collision_stats.account_text(text_id, merged_tags)
+                if overlaps_writer is not None:
+                    overlaps_writer.writerows(
+                        text_overlap_rows(
+                            text_id, get_merged_text_overlaps(merged_tags)
+                        )
+                    )
+    elif args.incremental:
+        fingerprints_path = dfio.sidecar_path(args.output_path, ".fingerprints.csv")
+        change_log_path = dfio.sidecar_path(args.output_path, ".changes.csv")
 
-    return result
+        input_dfs = dict(
+            (src_name, pandas.read_csv(input_path))
+            for (src_name, input_path) in zip(src_names, args.input_paths)
+        )
+        current_fingerprints: SourceFingerprints = dict(
+            (src_name, dfio.fingerprint_df(input_df))
+            for (src_name, input_df) in input_dfs.items()
+        )
 
+        # without a complete previous run in the same offsets-only mode every text is merged
+        previous_fingerprints: SourceFingerprints = dict()
+        previous_rows: dict[str, str] = dict()
+        if os.path.exists(args.output_path) and os.path.exists(fingerprints_path):
+            (previous_fingerprints, previous_offsets_only) = load_fingerprints(
+                fingerprints_path
+            )
+            if previous_offsets_only != args.offsets_only:
+                previous_fingerprints = dict()
+        if len(previous_fingerprints) > 0:
+            previous_df = pandas.read_csv(args.output_path)
+            previous_rows = dict(
+                zip(previous_df["sha512"], previous_df["ner_positions"])
+            )
+            previous_df = None
 
-__all__ = ["merge_text_bodies"]
+        changes = diff_fingerprints(previous_fingerprints, current_fingerprints)
 
-if __name__ == "__main__":
-    import sys
-    import pandas
+        # only the rows of changed texts are parsed and merged
+        changed_dicts = dict(
+            (src_name, dfio.df_to_dict(input_df[input_df["sha512"].isin(changes)]))
+            for (src_name, input_df) in input_dfs.items()
+        )
+        input_dfs = None
+        changed_merged = merge_many_text_bodies(changed_dicts)
+        changed_dicts = None
+        changed_df = dfio.dict_to_df(
+            cast(dfio.TextToNerPositions, changed_merged),
+            offsets_only=args.offsets_only,
+        )
+
+        # previous contributions of the changed texts are replaced by the new ones,
+        # statistics are only updated when they describe the previous output
+        update_merge_stats = False
+        if len(previous_rows) > 0 and os.path.exists(stats_path):
+            previous_stats = TagSourceStatistic.read_csv(stats_path)
+            update_merge_stats = previous_stats.describes(args.output_path)
+            if update_merge_stats:
+                merge_stats = previous_stats
+            previous_stats = None
+        update_collision_stats = False
+        if (
+            args.collision_stats
+            and len(previous_rows) > 0
+            and os.path.exists(collision_stats_path)
+        ):
+            previous_collision_stats = CollisionStatistic.read_csv(collision_stats_path)
+            update_collision_stats = previous_collision_stats.describes(
+                args.output_path
+            )
+            if update_collision_stats:
+                collision_stats = previous_collision_stats
+            previous_collision_stats = None
+        if update_merge_stats or update_collision_stats:
+            previous_changed = list(
+                parse_merged_rows(
+                    dict((t, previous_rows[t]) for t in changes if t in previous_rows)
+                )
+            )
+            if update_merge_stats:
+                merge_stats.update(previous_changed, changed_merged.items())
+            if update_collision_stats:
+                collision_stats.update(previous_changed, changed_merged.items())
+            previous_changed = None
+        changed_merged = None
+
+        output_rows = splice_merged_rows(
+            previous_rows,
+            dict(zip(changed_df["sha512"], changed_df["ner_positions"])),
+            changes,
+        )
+        previous_rows = None
+        with dfio.NerPositionsWriter(args.output_path) as writer:
+            for text_id, ner_positions_raw in output_rows.items():
+                writer.write_raw(text_id, ner_positions_raw)
+        # without previous statistics every text is accounted
+        account_collision_stats = args.collision_stats and not update_collision_stats
+        if account_collision_stats or not update_merge_stats:
+            for text_id, tag_dict in parse_merged_rows(output_rows):
+                if not update_merge_stats:
+                    merge_stats.account_text(text_id, tag_dict)
+                if account_collision_stats:
+                    collision_stats.account_text(text_id, tag_dict)
+        fingerprints_to_df(current_fingerprints, args.offsets_only).to_csv(
+            fingerprints_path, index=False
+        )
+        change_log_to_df(changes).to_csv(change_log_path, index=False)
+    else:
+        # reading and formating inputs
+        input_dicts: dict[str, dfio.TextToNerPositions] = dict()
+        for src_name, input_path in zip(src_names, args.input_paths):
+            input_df = pandas.read_csv(input_path)
+            input_dicts[src_name] = dfio.df_to_dict(input_df)
+            input_df = None  # marked as ready for GC
+
+        # processin merge
+        merged_dict = merge_many_text_bodies(input_dicts, merge_stats)
+        input_dicts = None
+        if args.collision_stats:
+            for text_id, merged_tags in merged_dict.items():
+                collision_stats.account_text(text_id, merged_tags)
+        if args.overlaps is not None:
+            text_overlaps = dict(
+                (text_id, get_merged_text_overlaps(merged_tags))
+                for (text_id, merged_tags) in merged_dict.items()
+            )
+        # casting strict superset to subset
+        merged_dict = cast(dfio.TextToNerPositions, merged_dict)
+
+        # writting output
+        dfio.write_csv(merged_dict, args.output_path, offsets_only=args.offsets_only)
+        merged_dict = None
 
-    if len(sys.argv) != 4:
-        print(
-            f"usage: {sys.argv[0]} ner_input.csv tagger_input.csv output.csv",
-            file=sys.stderr,
+    merge_stats.to_csv(stats_path, source_path=args.output_path)
+    if not args.incremental:
+        # the state of previous incremental runs no longer matches the output
+        dfio.remove_sidecars(args.output_path, ".fingerprints.csv", ".changes.csv")
+    if args.collision_stats:
+        collision_stats.to_csv(collision_stats_path, source_path=args.output_path)
+    elif os.path.exists(collision_stats_path):
+        # statistics of a previous run no longer match the output
+        os.remove(collision_stats_path)
+    if args.overlaps is not None and not args.streaming:
+        pandas.DataFrame(text_overlaps_to_dataset(text_overlaps)).to_csv(
+            args.overlaps, index=False
         )
-        sys.exit(1)
-
-    input_a_path = sys.argv[1]
-    input_b_path = sys.argv[2]
-    output_path = sys.argv[3]
-
-    # reading and formating ner input
-    input_a_df = pandas.read_csv(input_a_path)
-    input_a_dict = dfio.df_to_dict(input_a_df)
-    input_a_df = None  # marked as ready for GC
-
-    # reading and formating tagger input
-    input_b_df = pandas.read_csv(input_b_path)
-    input_b_dict = dfio.df_to_dict(input_b_df)
-    input_b_df = None
-
-    # processin merge
-    merged_dict = merge_text_bodies(input_a_dict, input_b_dict, "ner", "tagger")
-    input_a_dict = None
-    input_b_dict = None
-    # casting strict superset to subset
-    merged_dict = cast(dfio.TextToNerPositions, merged_dict)
-
-    # writting output
-    output_df = dfio.dict_to_df(merged_dict)
-    merged_dict = None
-    output_df.to_csv(output_path, index=False)
@@ -0,0 +1,239 @@
+#!/usr/bin/env -S uv run
+"""
+Filters merged data (texts with tag matches carrying a `src` mask) on text id, tag name, sources and span length.
+
+Filters are evaluated while streaming the rows of a merged file: text ids and tag names are checked on the raw rows
+before they are parsed, and only the matching texts are materialized.
+The same filters apply to a span table (see merge_stats.span_table) as vectorized column operations.
+"""
+
+from typing import Iterable, Iterator, NamedTuple, Optional, cast
+
+import numpy
+import pandas
+
+import dfio
+from merge_stats import (
+    NerPositionMatchSourced,
+    NerPositionsSourced,
+    SpanTable,
+    cast_ner_position_sourced,
+)
+from sources import SOURCE_NAMES, SrcMask, encode_sources, source_count
+
+
+class MatchFilter(NamedTuple):
+    """
+    Conjunction of predicates over merged matches, a predicate set to None always holds.
+    """
+
+    text_ids: Optional[frozenset[str]] = None  # text must be one of these
+    tags: Optional[frozenset[str]] = None  # tag must be one of these
+    src_all: SrcMask = 0  # match must come from all of these sources
+    src_none: SrcMask = 0  # match must come from none of these sources
+    min_sources: Optional[int] = None
+    max_sources: Optional[int] = None
+    min_length: Optional[int] = None  # char_end - char_start
+    max_length: Optional[int] = None
+
+
+def accepts_match(
+    match_filter: MatchFilter, tag_match: NerPositionMatchSourced
+) -> bool:
+    src_mask = tag_match["src"]
+    if src_mask & match_filter.src_all != match_filter.src_all:
+        return False
+    if src_mask & match_filter.src_none:
+        return False
+    if match_filter.min_sources is not None or match_filter.max_sources is not None:
+        src_count = source_count(src_mask)
+        if (
+            match_filter.min_sources is not None
+            and src_count < match_filter.min_sources
+        ):
+            return False
+        if (
+            match_filter.max_sources is not None
+            and src_count > match_filter.max_sources
+        ):
+            return False
+    if match_filter.min_length is not None or match_filter.max_length is not None:
+        length = tag_match["char_end"] - tag_match["char_start"]
+        if match_filter.min_length is not None and length < match_filter.min_length:
+            return False
+        if match_filter.max_length is not None and length > match_filter.max_length:
+            return False
+    return True
+
+
+def filter_text(
+    match_filter: MatchFilter, tag_dict: NerPositionsSourced
+) -> Optional[NerPositionsSourced]:
+    """
+    Keeps the matches of a single text that pass the filter, text ids are not checked.
+
+    Returns None when no match is left, tags without matches are left out.
+    """
+    result: NerPositionsSourced = dict()
+    for tag_name, match_list in tag_dict.items():
+        if match_filter.tags is not None and tag_name not in match_filter.tags:
+            continue
+        kept = [m for m in match_list if accepts_match(match_filter, m)]
+        if kept:
+            result[tag_name] = kept
+    return result if result else None
+
+
+def filter_texts(
+    match_filter: MatchFilter, texts: Iterable[tuple[str, NerPositionsSourced]]
+) -> Iterator[tuple[str, NerPositionsSourced]]:
+    """
+    Keeps the texts that still have matches once filtered, in input order.
+    """
+    for text_id, tag_dict in texts:
+        if match_filter.text_ids is not None and text_id not in match_filter.text_ids:
+            continue
+        filtered = filter_text(match_filter, tag_dict)
+        if filtered is not None:
+            yield (text_id, filtered)
+
+
+def _pushdown(match_filter: MatchFilter, chunk: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    Drops the raw rows that cannot pass the filter, before they are parsed.
+    """
+    if match_filter.text_ids is not None:
+        chunk = chunk[chunk["sha512"].isin(match_filter.text_ids)]
+    if match_filter.tags is not None:
+        # a tag appears in a raw ner_positions field as a quoted dictionary key
+        tag_keys = [repr(tag) for tag in match_filter.tags]
+        chunk = chunk[
+            chunk["ner_positions"].map(
+                lambda raw: isinstance(raw, str) and any(k in raw for k in tag_keys)
+            )
+        ]
+    return chunk
+
+
+def filter_csv(
+    path: str, match_filter: MatchFilter, *, chunksize: int = 1024
+) -> Iterator[tuple[str, NerPositionsSourced]]:
+    """
+    Streams the texts of a merged csv file that pass the filter, `chunksize` rows at a time.
+
+    :raises ValueError: if a parsed text has no `src` field
+    """
+    with pandas.read_csv(
+        path, usecols=["sha512", "ner_positions"], chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            for text_id, ner_positions in dfio.iter_df_rows(
+                _pushdown(match_filter, chunk)
+            ):
+                match cast_ner_position_sourced(ner_positions):
+                    case None:
+                        raise ValueError(f"text {text_id} is not merge data (no src)")
+                    case tag_dict:
+                        yield from filter_texts(match_filter, [(text_id, tag_dict)])
+
+
+def filter_span_table(match_filter: MatchFilter, spans: SpanTable) -> SpanTable:
+    """
+    Keeps the rows of a span table that pass the filter, evaluated as column operations.
+    """
+    keep = numpy.ones(len(spans), dtype=bool)
+    src = spans["src"].to_numpy()
+    if match_filter.text_ids is not None:
+        keep &= spans["text_id"].isin(match_filter.text_ids).to_numpy()
+    if match_filter.tags is not None:
+        keep &= spans["tag"].isin(match_filter.tags).to_numpy()
+    keep &= (src & match_filter.src_all) == match_filter.src_all
+    keep &= (src & match_filter.src_none) == 0
+    if match_filter.min_sources is not None or match_filter.max_sources is not None:
+        src_count = sum((src >> src_idx) & 1 for src_idx in range(len(SOURCE_NAMES)))
+        if match_filter.min_sources is not None:
+            keep &= src_count >= match_filter.min_sources
+        if match_filter.max_sources is not None:
+            keep &= src_count <= match_filter.max_sources
+    if match_filter.min_length is not None or match_filter.max_length is not None:
+        length = spans["char_end"].to_numpy() - spans["char_start"].to_numpy()
+        if match_filter.min_length is not None:
+            keep &= length >= match_filter.min_length
+        if match_filter.max_length is not None:
+            keep &= length <= match_filter.max_length
+    return spans[keep]
+
+
+def _split_names(names: Optional[str]) -> list[str]:
+    return [] if names is None else names.split(",")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="keeps the merged matches passing every given predicate"
+    )
+    parser.add_argument("input_path", metavar="merged.csv")
+    parser.add_argument("output_path", metavar="output.csv")
+    parser.add_argument(
+        "--text-id", action="append", help="keep this text (repeatable)"
+    )
+    parser.add_argument(
+        "--text-ids-file",
+        metavar="text_ids.txt",
+        help="keep the texts listed in this file, one sha512 per line",
+    )
+    parser.add_argument("--tag", action="append", help="keep this tag (repeatable)")
+    parser.add_argument(
+        "--src-all",
+        metavar="ner,tagger",
+        help="keep matches found by all of these sources",
+    )
+    parser.add_argument(
+        "--src-none",
+        metavar="ner,tagger",
+        help="keep matches found by none of these sources",
+    )
+    parser.add_argument("--min-sources", type=int)
+    parser.add_argument("--max-sources", type=int)
+    parser.add_argument("--min-length", type=int, help="minimum span length")
+    parser.add_argument("--max-length", type=int, help="maximum span length")
+    parser.add_argument(
+        "--reference-texts",
+        metavar="reference_texts.csv",
+        help="fill in the matched words from these source texts",
+    )
+    args = parser.parse_args()
+
+    text_ids: Optional[set[str]] = None
+    if args.text_id is not None or args.text_ids_file is not None:
+        text_ids = set(args.text_id or [])
+        if args.text_ids_file is not None:
+            with open(args.text_ids_file, encoding="utf-8") as text_ids_file:
+                text_ids.update(line.strip() for line in text_ids_file if line.strip())
+
+    try:
+        match_filter = MatchFilter(
+            text_ids=None if text_ids is None else frozenset(text_ids),
+            tags=None if args.tag is None else frozenset(args.tag),
+            src_all=encode_sources(_split_names(args.src_all)),
+            src_none=encode_sources(_split_names(args.src_none)),
+            min_sources=args.min_sources,
+            max_sources=args.max_sources,
+            min_length=args.min_length,
+            max_length=args.max_length,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    # only the matching texts are held in memory
+    output_dict = cast(
+        dfio.TextToNerPositions, dict(filter_csv(args.input_path, match_filter))
+    )
+    if args.reference_texts is not None:
+        output_dict = dfio.materialize_words(
+            output_dict, dfio.read_reference_texts(args.reference_texts, output_dict)
+        )
+
+    dfio.write_csv(output_dict, args.output_path)
@@ -1,20 +1,35 @@
 #!/usr/bin/env -S uv run
 
+import json
+import multiprocessing
 import pandas
 import sys
+from collections import Counter
 from dfio import (
     NerPositions,
     TextToNerPositions,
     df_to_dict,
+    file_fingerprint,
     NerPositionsMatch,
 )
-from typing import Optional, Required, Self, TextIO, cast, TypeVar
+from sources import SrcMask, decode_sources, encode_sources
+from typing import (
+    Generic,
+    Hashable,
+    Iterable,
+    Optional,
+    Required,
+    Self,
+    TextIO,
+    cast,
+    TypeVar,
+)
 
 T = TypeVar("T")
 
 
 class NerPositionMatchSourced(NerPositionsMatch):
-    src: Required[list[str]]
+    src: Required[SrcMask]  # see sources.py
 
 
 NerPositionsSourced = dict[str, list[NerPositionMatchSourced]]
@@ -25,10 +40,19 @@ def cast_ner_position_match_sourced(
     ner_position_match: NerPositionsMatch,
 ) -> Optional[NerPositionMatchSourced]:
     match ner_position_match.get("src"):
-        case src_list if isinstance(src_list, list):
+        case bool():
+            return None
+        case int():
+            pass
+        case list() as src_list:
+            # older format: list of source names, converted to a mask in place
             for src in src_list:
                 if not isinstance(src, str):
                     return None
+            try:
+                cast(dict, ner_position_match)["src"] = encode_sources(src_list)
+            except ValueError:
+                return None
         case _:
             return None
     return cast(NerPositionMatchSourced, ner_position_match)
@@ -65,37 +89,261 @@ def sort_dict_items(input_dict: dict[str, T]) -> list[tuple[str, T]]:
     return result
 
 
-class TagSourceStatistic:
+# one row per span, columns: text_id, tag, char_start, char_end, src
+SpanTable = pandas.DataFrame
+
+
+def span_table(data_src: TextToNerPositionsSourced) -> SpanTable:
+    """
+    Flattens merged data into a span table, one row per span in text then tag order.
+    """
+    text_ids: list[str] = []
+    tags: list[str] = []
+    char_starts: list[int] = []
+    char_ends: list[int] = []
+    srcs: list[SrcMask] = []
+    for text_id, tag_dict in data_src.items():
+        for tag, match_list in tag_dict.items():
+            for tag_match in match_list:
+                text_ids.append(text_id)
+                tags.append(tag)
+                char_starts.append(tag_match["char_start"])
+                char_ends.append(tag_match["char_end"])
+                srcs.append(tag_match["src"])
+    return pandas.DataFrame(
+        {
+            "text_id": text_ids,
+            "tag": tags,
+            "char_start": pandas.Series(char_starts, dtype="int64"),
+            "char_end": pandas.Series(char_ends, dtype="int64"),
+            "src": pandas.Series(srcs, dtype="int64"),
+        }
+    )
+
+
+CountKey = TypeVar("CountKey", bound=Hashable)
+
+
+class TextCountStatistic(Generic[CountKey]):
+    """
+    Counts kept as a sum of per text counts (see `text_counts`),
+    meant to be passed as the accumulator of a merge (see merge_data_src_v2.MergeAccumulator).
+
+    As every count is a sum over texts, the statistics of a corpus are updated from the texts that changed
+    by removing the counts of their previous version and adding those of the new one (see `update`).
+    """
+
+    def __init__(self):
+        self.counts: Counter[CountKey] = Counter()
+        # fingerprint of the merged file the statistics were counted from, see dfio.file_fingerprint
+        self.source_fingerprint: Optional[str] = None
+
+    def text_counts(self, tag_dict: NerPositionsSourced) -> Counter[CountKey]:
+        """
+        Counts of a single merged text.
+        """
+        raise NotImplementedError
+
+    def account_text(self, text_id: str, tag_dict: NerPositionsSourced) -> None:
+        self.counts.update(self.text_counts(tag_dict))
+
+    def remove_text(self, text_id: str, tag_dict: NerPositionsSourced) -> None:
+        """
+        Removes the counts of a text previously accounted with the same tags.
+
+        :raises ValueError: if the text was not accounted, the counts are then left unchanged
+        """
+        text_counts = self.text_counts(tag_dict)
+        if any(self.counts[key] < count for (key, count) in text_counts.items()):
+            raise ValueError(f"text {text_id} was not accounted in these statistics")
+        self.counts.subtract(text_counts)
+        self.counts = +self.counts
+
+    def update(
+        self,
+        removed: Iterable[tuple[str, NerPositionsSourced]],
+        added: Iterable[tuple[str, NerPositionsSourced]],
+    ) -> Self:
+        """
+        Removes the previous version of changed or removed texts, then adds the current version of changed or added texts
+        (see merge_data_src_v2.py --incremental).
+        """
+        for text_id, tag_dict in removed:
+            self.remove_text(text_id, tag_dict)
+        for text_id, tag_dict in added:
+            self.account_text(text_id, tag_dict)
+        return self
+
+    def describes(self, path: str) -> bool:
+        """
+        Tells whether these statistics were written for the current content of the merged file at `path`.
+        """
+        return self.source_fingerprint is not None and (
+            self.source_fingerprint == file_fingerprint(path)
+        )
+
+    def _write_csv(
+        self, df: pandas.DataFrame, path: str, source_path: Optional[str]
+    ) -> None:
+        # with `source_path`, the fingerprint of the merged file is recorded on every row (see `describes`)
+        if source_path is not None:
+            df = df.assign(source_fingerprint=file_fingerprint(source_path))
+        df.to_csv(path, index=False)
+
+    def _read_source_fingerprint(self, df: pandas.DataFrame) -> None:
+        if "source_fingerprint" in df.columns and len(df) > 0:
+            self.source_fingerprint = str(df["source_fingerprint"].iat[0])
+
+
+class TagSourceStatistic(TextCountStatistic[tuple[str, SrcMask]]):
+    """
+    Counts merged spans per tag and source combination (mask, see sources.py).
+
+    Statistics accumulate over any number of `account_stats` calls and can be merged with `merge` or `+`,
+    so shards can be counted separately, e.g. in worker processes, then combined in any order.
+    """
+
     def __init__(self):
-        self.total_tags_count: int = 0
-        self.src_tag_count: dict[str, int] = dict()
-        self.src_tag_type_count: dict[str, dict[str, int]] = dict()
+        super().__init__()
         self.__acounted: bool = False
 
     def isaccounted(self):
         return self.__acounted
 
+    @property
+    def total_tags_count(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def tag_count(self) -> dict[str, int]:
+        result: dict[str, int] = dict()
+        for (tag, _), count in self.counts.items():
+            result[tag] = result.get(tag, 0) + count
+        return result
+
+    @property
+    def src_tag_count(self) -> dict[str, int]:
+        result: dict[str, int] = dict()
+        for (_, src_mask), count in self.counts.items():
+            for src in decode_sources(src_mask):
+                result[src] = result.get(src, 0) + count
+        return result
+
+    @property
+    def src_tag_type_count(self) -> dict[str, dict[str, int]]:
+        """
+        Counts per source and tag prefix (first letter of the tag).
+        """
+        result: dict[str, dict[str, int]] = dict()
+        for (tag, src_mask), count in self.counts.items():
+            tag_prefix = tag[0:1]
+            for src in decode_sources(src_mask):
+                tag_type_count = result.setdefault(src, dict())
+                tag_type_count[tag_prefix] = tag_type_count.get(tag_prefix, 0) + count
+        return result
+
+    def account_span_table(self, spans: SpanTable) -> Self:
+        """
+        Adds the spans of a span table (see `span_table`) to the statistics, counted in a single grouped pass.
+        """
+        counts = spans.groupby(["tag", "src"], sort=False).size()
+        for (tag, src_mask), count in counts.items():
+            self.counts[(str(tag), int(src_mask))] += int(count)
+        self.__acounted = True
+        return self
+
     def account_stats(self, data_src: TextToNerPositionsSourced) -> Self:
-        if self.__acounted:
-            raise RuntimeError("Stat already acounted")
-
-        for text_id, tag_dict in data_src.items():
-            for tag, match_list in tag_dict.items():
-                tag_prefix = tag[0:1]
-                for tag_match in match_list:
-                    self.total_tags_count += 1
-                    for src in tag_match.get("src"):
-                        src_count = self.src_tag_count.setdefault(src, 0) + 1
-                        self.src_tag_count[src] = src_count
-
-                        tag_type_count = self.src_tag_type_count.setdefault(src, dict())
-                        tag_type_count[tag_prefix] = (
-                            tag_type_count.setdefault(tag_prefix, 0) + 1
-                        )
+        return self.account_span_table(span_table(data_src))
+
+    def text_counts(
+        self, tag_dict: NerPositionsSourced
+    ) -> Counter[tuple[str, SrcMask]]:
+        result: Counter[tuple[str, SrcMask]] = Counter()
+        for tag, match_list in tag_dict.items():
+            for tag_match in match_list:
+                result[(tag, tag_match["src"])] += 1
+        return result
 
+    def account_text(self, text_id: str, tag_dict: NerPositionsSourced) -> None:
+        """
+        Adds the spans of a single merged text, meant to be called by the merge as each text is merged.
+        """
+        super().account_text(text_id, tag_dict)
         self.__acounted = True
+
+    def merge(self, other: "TagSourceStatistic") -> Self:
+        """
+        Adds the counts of `other` to these statistics.
+        """
+        self.counts.update(other.counts)
+        self.__acounted = self.__acounted or other.isaccounted()
         return self
 
+    def __add__(self, other: "TagSourceStatistic") -> "TagSourceStatistic":
+        return TagSourceStatistic().merge(self).merge(other)
+
+    def to_df(self) -> pandas.DataFrame:
+        """
+        Exports the counts as a table sorted by tag then mask: tag, src (mask), sources (names), count.
+        """
+        rows = sorted(self.counts.items())
+        return pandas.DataFrame(
+            {
+                "tag": [tag for ((tag, _), _) in rows],
+                "src": [src_mask for ((_, src_mask), _) in rows],
+                "sources": [
+                    "+".join(decode_sources(src_mask)) for ((_, src_mask), _) in rows
+                ],
+                "count": [count for (_, count) in rows],
+            }
+        )
+
+    def to_csv(self, path: str, *, source_path: Optional[str] = None) -> None:
+        """
+        Writes the counts (see `to_df`).
+
+        With `source_path`, the fingerprint of the merged file the statistics describe is recorded on every row
+        (see `describes`).
+        """
+        self._write_csv(self.to_df(), path, source_path)
+
+    def to_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as json_file:
+            json.dump(
+                {
+                    "total_tags_count": self.total_tags_count,
+                    "src_tag_count": dict(sort_dict_items(self.src_tag_count)),
+                    "src_tag_type_count": dict(
+                        (src, dict(sort_dict_items(prefix_count)))
+                        for (src, prefix_count) in sort_dict_items(
+                            self.src_tag_type_count
+                        )
+                    ),
+                    "tag_src_count": self.to_df().to_dict(orient="records"),
+                },
+                json_file,
+                indent=2,
+            )
+
+    @classmethod
+    def read_csv(cls, path: str) -> "TagSourceStatistic":
+        """
+        Loads statistics written by `to_csv`, for instance to merge the statistics of several runs.
+        """
+        df = pandas.read_csv(
+            path,
+            dtype={"tag": str, "src": int, "count": int},
+            keep_default_na=False,
+        )
+        result = cls()
+        for tag, src_mask, count in df[["tag", "src", "count"]].itertuples(
+            index=False, name=None
+        ):
+            result.counts[(tag, src_mask)] += count
+        result.__acounted = True
+        result._read_source_fingerprint(df)
+        return result
+
     def print_stats(self, file: TextIO = sys.stdout):
         if not self.__acounted:
             raise RuntimeError("cannot print statistics that have not been acounted")
@@ -103,26 +351,67 @@ class TagSourceStatistic:
         print("tag per source:", file=file)
         for src, src_count in sort_dict_items(self.src_tag_count):
             print(f'\t"{src}": {src_count}', file=file)
-        # print("tag prefix per source:")
-        # for src, src_prefix_dict in sort_dict_items(self.src_tag_type_count):
-        #     print(f'\t"{src}":', file=file)
-        #     for src_prefix, src_prefix_count in sort_dict_items(src_prefix_dict):
-        #         print(f'\t\t"{src_prefix}": {src_prefix_count}')
+        print("tag prefix per source:", file=file)
+        for src, src_prefix_dict in sort_dict_items(self.src_tag_type_count):
+            print(f'\t"{src}":', file=file)
+            for src_prefix, src_prefix_count in sort_dict_items(src_prefix_dict):
+                print(f'\t\t"{src_prefix}": {src_prefix_count}', file=file)
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(f"usage: {sys.argv[0]} merged_file.csv")
-        sys.exit(1)
+def _chunk_stats(chunk_df: pandas.DataFrame) -> TagSourceStatistic:
+    match cast_text_to_ner_position_sourced(df_to_dict(chunk_df)):
+        case None:
+            raise ValueError("data is not merge data")
+        case chunk_data:
+            return TagSourceStatistic().account_stats(chunk_data)
 
-    merged_file_path = sys.argv[1]
 
-    df = pandas.read_csv(merged_file_path)
+def file_stats(
+    path: str, *, jobs: int = 1, chunksize: int = 4096
+) -> TagSourceStatistic:
+    """
+    Computes the statistics of a merged csv file, `chunksize` rows at a time.
+
+    With `jobs` greater than 1 the chunks are parsed and counted in worker processes.
+    """
+    result = TagSourceStatistic()
+    with pandas.read_csv(
+        path, usecols=["sha512", "ner_positions"], chunksize=chunksize
+    ) as reader:
+        if jobs <= 1:
+            for chunk_df in reader:
+                result.merge(_chunk_stats(chunk_df))
+        else:
+            with multiprocessing.Pool(jobs) as pool:
+                for chunk_stats in pool.imap_unordered(_chunk_stats, reader):
+                    result.merge(chunk_stats)
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("merged_file_path", metavar="merged_file.csv")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes counting chunks of the file",
+    )
+    parser.add_argument(
+        "--csv",
+        metavar="stats.csv",
+        help="export counts per tag and source combination",
+    )
+    parser.add_argument(
+        "--json", metavar="stats.json", help="export all statistics as json"
+    )
+    args = parser.parse_args()
 
-    work_data = df_to_dict(df)
-    work_data_validated = cast_text_to_ner_position_sourced(work_data)
-    if work_data_validated is None:
-        raise ValueError("data is not merge data")
-    stats = TagSourceStatistic()
-    stats.account_stats(work_data_validated)
+    stats = file_stats(args.merged_file_path, jobs=args.jobs)
     stats.print_stats()
+    if args.csv is not None:
+        stats.to_csv(args.csv, source_path=args.merged_file_path)
+    if args.json is not None:
+        stats.to_json(args.json)
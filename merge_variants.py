@@ -0,0 +1,190 @@
+#!/usr/bin/env -S uv run
+"""
+Runs the v1 and v2 merges over both tagger variants (BILOU stripped and tag merged) in a single process.
+
+Each input is read and parsed once, every merge then works on the same parsed data.
+"""
+
+import multiprocessing
+import os
+from typing import NamedTuple, Optional, cast
+
+import pandas
+
+import dfio
+import merge_data_src_v1
+from merge_data_src_v2 import merge_text_bodies
+from merge_stats import TagSourceStatistic
+from tag_match_analysis import get_merged_text_overlaps, text_overlaps_to_dataset
+
+
+class MergeVariant(NamedTuple):
+    version: str  # "v1" or "v2"
+    tagger_input: str  # "stripped" or "tag_merged"
+
+
+ALL_VARIANTS = [
+    MergeVariant("v1", "stripped"),
+    MergeVariant("v2", "stripped"),
+    MergeVariant("v1", "tag_merged"),
+    MergeVariant("v2", "tag_merged"),
+]
+
+# variant whose cross tag overlaps are written when an overlaps path is given
+OVERLAPS_VARIANT = MergeVariant("v2", "tag_merged")
+
+# Parsed inputs, filled in by load_inputs.
+# Worker processes are forked after loading so they share this data copy-on-write.
+_loaded_inputs: dict[str, dfio.TextToNerPositions] = dict()
+# The same parsed rows in file order, duplicate and malformed rows kept (see merge_data_src_v1.iter_df_labels),
+# as the v1 merge reads them.
+_loaded_label_rows: dict[str, list[tuple[str, dfio.NerPositions]]] = dict()
+
+
+def variant_output_name(variant: MergeVariant) -> str:
+    return f"merged_{variant.tagger_input}_{variant.version}.csv"
+
+
+def load_inputs(ner_path: str, stripped_path: str, tag_merged_path: str) -> None:
+    for input_name, input_path in (
+        ("ner", ner_path),
+        ("stripped", stripped_path),
+        ("tag_merged", tag_merged_path),
+    ):
+        input_df = pandas.read_csv(input_path)
+        err_idx: list[int] = []
+        rows = list(dfio.iter_df_rows(input_df, err_idx=err_idx))
+        # as dfio.df_to_dict: the last row of a text wins, malformed rows are left out
+        _loaded_inputs[input_name] = dict(rows)
+        _loaded_label_rows[input_name] = rows + list(
+            merge_data_src_v1.malformed_labels(input_df, err_idx)
+        )
+        input_df = None  # allows GC to free memory
+
+
+def run_variant(
+    variant: MergeVariant,
+    output_dir: str,
+    offsets_only: bool,
+    overlaps_path: Optional[str] = None,
+) -> str:
+    """
+    Merges the NER input with one of the tagger inputs and writes the result to `output_dir`.
+
+    v2 merges also write their statistics next to the output (see `merge_stats.TagSourceStatistic`).
+    For `OVERLAPS_VARIANT`, the cross tag overlaps of the merged texts are also written to `overlaps_path` when given.
+
+    Returns the path of the written file.
+    """
+    ner_dict = _loaded_inputs["ner"]
+    tagger_dict = _loaded_inputs[variant.tagger_input]
+    output_path = os.path.join(output_dir, variant_output_name(variant))
+
+    match variant.version:
+        case "v1":
+            merged_v1: merge_data_src_v1.TextLabelDict = dict()
+            merge_data_src_v1.accumulate_labels(
+                merged_v1, _loaded_label_rows["ner"], "ner"
+            )
+            merge_data_src_v1.accumulate_labels(
+                merged_v1, _loaded_label_rows[variant.tagger_input], "onet"
+            )
+            dfio.write_csv(
+                cast(
+                    dfio.TextToNerPositions,
+                    merge_data_src_v1.label_dict_to_text_dict(merged_v1),
+                ),
+                output_path,
+            )
+        case "v2":
+            merge_stats = TagSourceStatistic()
+            merged_v2 = merge_text_bodies(
+                ner_dict, tagger_dict, "ner", "tagger", merge_stats
+            )
+            if overlaps_path is not None and variant == OVERLAPS_VARIANT:
+                text_overlaps = dict(
+                    (text_id, get_merged_text_overlaps(merged_tags))
+                    for (text_id, merged_tags) in merged_v2.items()
+                )
+                pandas.DataFrame(text_overlaps_to_dataset(text_overlaps)).to_csv(
+                    overlaps_path, index=False
+                )
+            dfio.write_csv(
+                cast(dfio.TextToNerPositions, merged_v2),
+                output_path,
+                offsets_only=offsets_only,
+            )
+            # after the output, so the statistics are never older than it
+            merge_stats.to_csv(
+                dfio.sidecar_path(output_path, ".stats.csv"), source_path=output_path
+            )
+        case unknown:
+            raise ValueError(f"unknown merge version {unknown}")
+
+    # the state of previous incremental runs (see merge_data_src_v2.py --incremental) no longer matches the output
+    dfio.remove_sidecars(
+        output_path, ".fingerprints.csv", ".changes.csv", ".collision_stats.csv"
+    )
+
+    return output_path
+
+
+def _run_variant_star(args: tuple[MergeVariant, str, bool, Optional[str]]) -> str:
+    return run_variant(*args)
+
+
+def run_all_variants(
+    output_dir: str,
+    *,
+    jobs: int = 1,
+    offsets_only: bool = False,
+    overlaps_path: Optional[str] = None,
+) -> list[str]:
+    """
+    Runs every merge variant over the loaded inputs.
+
+    With `jobs` greater than 1 the variants are spread over forked worker processes.
+    """
+    tasks = [
+        (variant, output_dir, offsets_only, overlaps_path) for variant in ALL_VARIANTS
+    ]
+    if jobs <= 1:
+        return list(map(_run_variant_star, tasks))
+
+    with multiprocessing.get_context("fork").Pool(min(jobs, len(tasks))) as pool:
+        return pool.map(_run_variant_star, tasks, chunksize=1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ner_path", metavar="ner_input.csv")
+    parser.add_argument("stripped_path", metavar="bilou_stripped.csv")
+    parser.add_argument("tag_merged_path", metavar="tag_merged.csv")
+    parser.add_argument("output_dir", metavar="output_dir")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes running the merges",
+    )
+    parser.add_argument(
+        "--offsets-only",
+        action="store_true",
+        help="only write match offsets in v2 outputs, words are left out",
+    )
+    parser.add_argument(
+        "--overlaps",
+        metavar="colision_list.csv",
+        help="also write the cross tag overlaps of the v2 tag merged output, as tag_match_analysis.py would",
+    )
+    args = parser.parse_args()
+
+    load_inputs(args.ner_path, args.stripped_path, args.tag_merged_path)
+    run_all_variants(
+        args.output_dir,
+        jobs=args.jobs,
+        offsets_only=args.offsets_only,
+        overlaps_path=args.overlaps,
+    )
@@ -1,16 +1,87 @@
+import functools
+import os
+
+import numpy as np
 import pandas as pd
 
+from dfio import file_fingerprint
+
 OnetTagReference = dict[str, str]
 
+ONET_REFERENCE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "data",
+    "onet_classification",
+    "Onet_association_fixed.csv",
+)
+# parsed reference cached next to the csv file with the fingerprint of the csv file it was read from
+_CACHE_SUFFIX = ".pkl"
+
+
+def _read_onet_csv(path: str) -> pd.Series:
+    df = pd.read_csv(path, sep=";")
+    tags = df.iloc[:, 0].astype(str)
+    examples = df.iloc[:, 1].astype(str)
+    return (
+        pd.Series(examples.to_numpy(), index=tags.to_numpy(), dtype=object)
+        # the last association of a tag wins, as when building a dict
+        .loc[lambda s: ~s.index.duplicated(keep="last")]
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def onet_reference_table(path: str = ONET_REFERENCE_PATH) -> pd.Series:
+    """
+    The O*NET example of each tag, as a Series indexed by tag.
+
+    Loaded once per process, from the binary cache next to the csv file when it was built from the current csv content.
+    The result is shared, it must not be modified.
+    """
+    cache_path = os.path.splitext(path)[0] + _CACHE_SUFFIX
+    fingerprint = file_fingerprint(path)
+    if os.path.exists(cache_path):
+        try:
+            (cached_fingerprint, table) = pd.read_pickle(cache_path)
+            if cached_fingerprint == fingerprint:
+                return table
+        except (ValueError, TypeError):
+            pass  # a cache in an older format is rebuilt
+
+    table = _read_onet_csv(path)
+    try:
+        pd.to_pickle((fingerprint, table), cache_path + ".tmp")
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError:
+        pass  # the cache is only an optimization
+    return table
+
+
+def load_onet_reference(path: str = ONET_REFERENCE_PATH) -> OnetTagReference:
+    return dict(onet_reference_table(path).items())
+
+
+def onet_labels(tags: pd.Series, path: str = ONET_REFERENCE_PATH) -> pd.Series:
+    """
+    The O*NET example of every tag of a column, empty for unknown tags.
 
-def load_onet_reference() -> OnetTagReference:
-    df = pd.read_csv("./data/onet_classification/Onet_association_fixed.csv", sep=";")
-    entry_iterator = df.itertuples(index=False, name=None)
-    return dict(((str(tag), str(example)) for (tag, example) in entry_iterator))
+    The reference is looked up once per distinct tag.
+    """
+    (codes, distinct_tags) = pd.factorize(tags)
+    labels = onet_reference_table(path).reindex(distinct_tags).fillna("").to_numpy()
+    # missing tags (code -1) pick the trailing empty label
+    labels = np.append(labels, "")
+    return pd.Series(labels[codes], index=tags.index, dtype=object)
 
 
 def onet_alphabetical_tags(tag_ref: OnetTagReference) -> list[str]:
     return list(sorted(tag_ref.keys()))
 
 
-__all__ = ["OnetTagReference", "load_onet_reference", "onet_alphabetical_tags"]
+__all__ = [
+    "OnetTagReference",
+    "ONET_REFERENCE_PATH",
+    "onet_reference_table",
+    "load_onet_reference",
+    "onet_labels",
+    "onet_alphabetical_tags",
+]
@@ -1,195 +1,213 @@
 #!/usr/bin/env -S uv run
 
 # import onet
-from tag_match_analysis import TagMatchStandalone, TagOverlap
+import numpy as np
 import pandas as pd
-from ast import literal_eval
-from typing import NamedTuple, TypedDict
-
-
-class TagMatchTuple(NamedTuple):
-    tag: str
-    char_start: int
-    char_end: int
-    src: str
-
-
-class ConflictError(NamedTuple):
-    total_error: int
-    different_tag: int
-    position: int
-    offender_list: frozenset[tuple[str, int]]
-
-
-OverlapTuple = tuple[TagMatchTuple, TagMatchTuple]
+import dfio
+from sources import parse_src_field
+from xlsx_report import write_df_by_major_tag
+from typing import NamedTuple
+
+
+OVERLAP_COLUMNS = [
+    "text_id",
+    "tag_a",
+    "char_start_a",
+    "char_end_a",
+    "src_a",
+    "tag_b",
+    "char_start_b",
+    "char_end_b",
+    "src_b",
+]
+
+
+def parse_src_column(raw_src: pd.Series) -> np.ndarray:
+    """
+    Reads a `src` column as masks, rows in the older list of source names format are parsed one by one.
+    """
+    if pd.api.types.is_integer_dtype(raw_src):
+        return raw_src.to_numpy(dtype="int64")
+    masks = pd.to_numeric(raw_src, errors="coerce")
+    legacy = masks.isna()
+    if legacy.any():
+        masks[legacy] = raw_src[legacy].map(parse_src_field)
+    return masks.to_numpy(dtype="int64")
+
+
+def load_overlap_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Loads an overlap list (see tag_match_analysis.text_overlaps_to_dataset) as columns.
+
+    Both tag columns are categorical over the same categories, in order of first appearance,
+    and source columns hold masks.
+    """
+    tags = pd.unique(np.column_stack([df["tag_a"], df["tag_b"]]).ravel())
+    result = df[OVERLAP_COLUMNS].copy()
+    for side in ("a", "b"):
+        result[f"tag_{side}"] = pd.Categorical(result[f"tag_{side}"], categories=tags)
+        result[f"src_{side}"] = parse_src_column(result[f"src_{side}"])
+    return result
 
 
-def standalone_to_tuple_match(input_match: TagMatchStandalone) -> TagMatchTuple:
-    return TagMatchTuple(
-        input_match["tag"],
-        input_match["char_start"],
-        input_match["char_end"],
-        input_match["src"][0],
-    )
+def _conflict_codes(
+    overlaps: pd.DataFrame,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Lists the conflicts of an overlap table: each overlap is a conflict for both of its tags, in a then b order,
+    texts being taken in order of first appearance.
+
+    Returns the tags (in order of first appearance) then, per conflict, the tag and offender codes and source masks.
+    """
+    text_order = np.argsort(pd.factorize(overlaps["text_id"])[0], kind="stable")
+    tag_a = overlaps["tag_a"].to_numpy()[text_order]
+    tag_b = overlaps["tag_b"].to_numpy()[text_order]
+    (tag_codes, tags) = pd.factorize(np.column_stack([tag_a, tag_b]).ravel())
+    offender_codes = tag_codes.reshape(-1, 2)[:, ::-1].ravel()
+
+    src_a = overlaps["src_a"].to_numpy(dtype="int64")[text_order]
+    src_b = overlaps["src_b"].to_numpy(dtype="int64")[text_order]
+    tag_src = np.column_stack([src_a, src_b]).ravel()
+    offender_src = np.column_stack([src_b, src_a]).ravel()
+    return (np.asarray(tags), tag_codes, offender_codes, tag_src, offender_src)
+
+
+CONFLICT_ERROR_COLUMNS = [
+    "tag",
+    "position_error",
+    "different_tag_error",
+    "total_error",
+    "offender_list",
+]
+
+
+def conflict_error_table(overlaps: pd.DataFrame) -> pd.DataFrame:
+    """
+    Counts, for each tag, the matches it overlaps: with the same tag (position error) or another tag,
+    and per offending tag.
+
+    Tags are listed in order of first appearance, texts being taken in order of first appearance,
+    offenders of a tag in the order they are first met.
+    """
+    if len(overlaps) == 0:
+        return pd.DataFrame(columns=CONFLICT_ERROR_COLUMNS)
+
+    (tags, tag_codes, offender_codes, _, _) = _conflict_codes(overlaps)
+
+    tag_count = len(tags)
+    pair_codes = tag_codes.astype("int64") * tag_count + offender_codes
+    pair_count = np.bincount(pair_codes, minlength=tag_count * tag_count)
+    total_error = np.bincount(tag_codes, minlength=tag_count)
+    position_error = pair_count.reshape(tag_count, tag_count).diagonal()
+
+    (pairs, first_seen) = np.unique(pair_codes, return_index=True)
+    pairs = pairs[np.argsort(first_seen, kind="stable")]
+    pairs = pairs[np.argsort(pairs // tag_count, kind="stable")]
+    offender_list: list[dict[str, int]] = [dict() for _ in range(tag_count)]
+    for pair in pairs.tolist():
+        offender_list[pair // tag_count][tags[pair % tag_count]] = int(pair_count[pair])
 
-
-def overlap_standalone_to_overlap_tuple(standalone: TagOverlap) -> OverlapTuple:
-    (a, b) = standalone
-    return (standalone_to_tuple_match(a), standalone_to_tuple_match(b))
-
-
-def load_text_overlaps(df: pd.DataFrame) -> dict[str, list[TagOverlap]]:
-    result: dict[str, list[TagOverlap]] = dict()
-
-    for (
-        text_id,
-        tag_a,
-        char_start_a,
-        char_end_a,
-        src_a,
-        tag_b,
-        char_start_b,
-        char_end_b,
-        src_b,
-    ) in df[
-        [
-            "text_id",
-            "tag_a",
-            "char_start_a",
-            "char_end_a",
-            "src_a",
-            "tag_b",
-            "char_start_b",
-            "char_end_b",
-            "src_b",
-        ]
-    ].itertuples(index=False, name=None):
-        overlap_list = result.setdefault(text_id, [])
-        match_a: TagMatchStandalone = {
-            "tag": tag_a,
-            "char_start": char_start_a,
-            "char_end": char_end_a,
-            "src": literal_eval(src_a),
-            "word": "",
-        }
-        match_b: TagMatchStandalone = {
-            "tag": tag_b,
-            "char_start": char_start_b,
-            "char_end": char_end_b,
-            "src": literal_eval(src_b),
-            "word": "",
+    return pd.DataFrame(
+        {
+            "tag": tags,
+            "position_error": position_error,
+            "different_tag_error": total_error - position_error,
+            "total_error": total_error,
+            "offender_list": list(map(repr, offender_list)),
         }
-        overlap_list.append((match_a, match_b))
-
-    return result
-
-
-def text_standalone_to_text_tuple(
-    text_data: dict[str, list[TagOverlap]],
-) -> dict[str, list[OverlapTuple]]:
-    return dict(
-        (text_id, list(map(overlap_standalone_to_overlap_tuple, overlaps)))
-        for (text_id, overlaps) in text_data.items()
     )
 
 
-def resolve_per_tag_conflict(
-    text_data: dict[str, list[OverlapTuple]],
-) -> dict[str, list[TagMatchTuple]]:
-    result: dict[str, list[TagMatchTuple]] = dict()
-
-    for _, overlap_list in text_data.items():
-        for match_a, match_b in overlap_list:
-            tag_a_conflic_list = result.setdefault(match_a.tag, [])
-            tag_a_conflic_list.append(match_b)
-
-            tag_b_conflic_list = result.setdefault(match_b.tag, [])
-            tag_b_conflic_list.append(match_a)
-
-    return result
+class ConflictMatrix(NamedTuple):
+    """
+    Conflict counts: counts[p, t, o] conflicts of a `tags[t]` match found by `src_pairs[p, 0]`
+    with a `tags[o]` match found by `src_pairs[p, 1]` (position conflicts on the diagonal).
+    """
 
+    tags: np.ndarray
+    src_pairs: np.ndarray  # (source pair, 2) masks
+    counts: np.ndarray  # (source pair, tag, offender)
 
-def conflict_error_helper(
-    conflict_list: list[TagMatchTuple], tag_name: str
-) -> ConflictError:
-    position_error = 0
-    tag_error = 0
-    offender_list: dict[str, int] = dict()
 
-    for conflict in conflict_list:
-        if conflict.tag == tag_name:
-            position_error += 1
-        else:
-            tag_error += 1
-        current_count = offender_list.setdefault(conflict.tag, 0)
-        offender_list[conflict.tag] = current_count + 1
+def conflict_matrix(overlaps: pd.DataFrame) -> ConflictMatrix:
+    """
+    Counts the conflicts of an overlap table per source pair, tag and offending tag.
 
-    return ConflictError(
-        len(conflict_list), tag_error, position_error, frozenset(offender_list.items())
+    Summed over source pairs, a row of the matrix holds the offender_list of `conflict_error_table`.
+    """
+    (tags, tag_codes, offender_codes, tag_src, offender_src) = _conflict_codes(overlaps)
+    (src_pairs, src_pair_codes) = np.unique(
+        np.column_stack([tag_src, offender_src]), axis=0, return_inverse=True
     )
-
-
-def account_conflict_error(
-    tag_conflict: dict[str, list[TagMatchTuple]],
-) -> dict[str, ConflictError]:
-    return dict(
-        (
-            (tag, conflict_error_helper(conflicts, tag))
-            for (tag, conflicts) in tag_conflict.items()
-        )
+    src_pair_codes = src_pair_codes.reshape(-1)
+    tag_count = len(tags)
+    cell_codes = (src_pair_codes * tag_count + tag_codes) * tag_count + offender_codes
+    counts = np.bincount(cell_codes, minlength=len(src_pairs) * tag_count * tag_count)
+    return ConflictMatrix(
+        tags.astype(str),
+        src_pairs,
+        counts.reshape(len(src_pairs), tag_count, tag_count),
     )
 
 
-def tag_conflict_error_to_df(tag_conflict: dict[str, ConflictError]) -> pd.DataFrame:
-    tag: list[str] = []
-    position_error: list[int] = []
-    different_tag_error: list[int] = []
-    total_error: list[int] = []
-    offender_list: list[str] = []
-
-    for tag_in_conflict, conflict in tag_conflict.items():
-        tag.append(tag_in_conflict)
-        position_error.append(conflict.position)
-        different_tag_error.append(conflict.different_tag)
-        offender_list.append(repr(dict(iter(conflict.offender_list))))
-        total_error.append(conflict.total_error)
-
-    return pd.DataFrame(
-        {
-            "tag": tag,
-            "position_error": position_error,
-            "different_tag_error": different_tag_error,
-            "total_error": total_error,
-            "offender_list": offender_list,
-        }
+def save_conflict_matrix(matrix: ConflictMatrix, path: str) -> None:
+    """
+    Saves the non zero cells of a conflict matrix as a compressed .npz file,
+    with its tag label table next to it (`<path>.tags.csv`).
+    """
+    (src_pair, tag, offender) = np.nonzero(matrix.counts)
+    np.savez_compressed(
+        path,
+        tags=matrix.tags,
+        src_pairs=matrix.src_pairs,
+        src_pair=src_pair,
+        tag=tag,
+        offender=offender,
+        count=matrix.counts[src_pair, tag, offender],
+    )
+    pd.DataFrame({"code": np.arange(len(matrix.tags)), "tag": matrix.tags}).to_csv(
+        dfio.sidecar_path(path, ".tags.csv"), index=False
     )
 
 
-if __name__ == "__main__":
-    import sys
+def load_conflict_matrix(path: str) -> ConflictMatrix:
+    with np.load(path) as npz:
+        counts = np.zeros(
+            (len(npz["src_pairs"]), len(npz["tags"]), len(npz["tags"])), dtype="int64"
+        )
+        counts[npz["src_pair"], npz["tag"], npz["offender"]] = npz["count"]
+        return ConflictMatrix(npz["tags"], npz["src_pairs"], counts)
 
-    if len(sys.argv) != 3:
-        print(f"usage: {sys.argv[0]} input.csv output.csv", file=sys.stderr)
-        sys.exit(1)
 
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path", metavar="colision_list.csv")
+    parser.add_argument("output_path", metavar="error_comptabilized.csv")
+    parser.add_argument(
+        "--xlsx",
+        metavar="report.xlsx",
+        help="also write the output as a workbook, one sheet per major tag",
+    )
+    parser.add_argument(
+        "--matrix",
+        metavar="conflicts.npz",
+        help="also save the tag x tag conflict counts per source pair",
+    )
+    args = parser.parse_args()
 
-    df = pd.read_csv(input_path)
+    df = pd.read_csv(args.input_path, keep_default_na=False)
 
-    input = load_text_overlaps(df)
+    overlaps = load_overlap_table(df)
     df = None
 
-    prepared_data = text_standalone_to_text_tuple(input)
-    input = None
-
-    per_tag_conflict = resolve_per_tag_conflict(prepared_data)
-    prepared_data = None
-
-    accounted_error = account_conflict_error(per_tag_conflict)
-    per_tag_conflict = None
+    if args.matrix is not None:
+        save_conflict_matrix(conflict_matrix(overlaps), args.matrix)
 
-    df = tag_conflict_error_to_df(accounted_error)
-    accounted_error = None
+    df = conflict_error_table(overlaps)
+    overlaps = None
 
-    df.to_csv(output_path, index=False, sep=";", encoding="utf-8")
+    df.to_csv(args.output_path, index=False, sep=";", encoding="utf-8")
+    if args.xlsx is not None:
+        write_df_by_major_tag(args.xlsx, df, "tag")
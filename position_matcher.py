@@ -7,7 +7,6 @@ import pandas as pd
 from typing import Iterable, Optional, TypeVar, cast
 from itertools import tee
 from tqdm import tqdm
-from sys import argv
 
 T = TypeVar("T")
 U = TypeVar("U")
@@ -94,25 +93,32 @@ def find_match_position(
 
 
 def matchdata_iterable_to_ner_position(
-    data_list: Iterable[MatchData],
+    data_list: Iterable[MatchData], offsets_only: bool = False
 ) -> dict[str, list[dict]]:
     """
     Morphs a series of MatchData to a dictionary suitable for the `ner_position` field of the output DataFrame
+
+    If `offsets_only` is set, the matched words are left out.
     """
     result: dict[str, list[dict]] = dict()
     for match_data in data_list:
         match_list = result.setdefault(match_data[0], [])
-        match_list.append(
-            {
-                "word": match_data[1],
-                "char_start": match_data[2][0],
-                "char_end": match_data[2][1],
-            }
-        )
+        if offsets_only:
+            match_list.append(
+                {"char_start": match_data[2][0], "char_end": match_data[2][1]}
+            )
+        else:
+            match_list.append(
+                {
+                    "word": match_data[1],
+                    "char_start": match_data[2][0],
+                    "char_end": match_data[2][1],
+                }
+            )
     return result
 
 
-def textmatch_to_df(text_match: TextMatch) -> pd.DataFrame:
+def textmatch_to_df(text_match: TextMatch, offsets_only: bool = False) -> pd.DataFrame:
     """
     Formats text matches to DataFrame suitable for output
     """
@@ -124,20 +130,35 @@ def textmatch_to_df(text_match: TextMatch) -> pd.DataFrame:
         {
             "sha512": (t[0] for t in text_id),
             "ner_positions": (
-                str(matchdata_iterable_to_ner_position(n[1])) for n in ner_position
+                str(matchdata_iterable_to_ner_position(n[1], offsets_only))
+                for n in ner_position
             ),
         }
     )
 
 
 if __name__ == "__main__":
-    if len(argv) != 4:
-        raise ValueError("check script usage")
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reference_texts_path", metavar="reference_texts.csv")
+    parser.add_argument("ner_matches_path", metavar="tagged_tokens.csv")
+    parser.add_argument("output_path", metavar="output.csv")
+    parser.add_argument(
+        "--offsets-only",
+        action="store_true",
+        help="only write match offsets, words are left out",
+    )
+    args = parser.parse_args()
 
     ## Aquiring data sources
-    reference_texts = pd.read_csv(argv[1], sep=";", encoding="utf-8", low_memory=False)
+    reference_texts = pd.read_csv(
+        args.reference_texts_path, sep=";", encoding="utf-8", low_memory=False
+    )
 
-    ner_matches = pd.read_csv(argv[2], sep=";", encoding="utf-8", low_memory=False)
+    ner_matches = pd.read_csv(
+        args.ner_matches_path, sep=";", encoding="utf-8", low_memory=False
+    )
 
     ## Data cleanup
 
@@ -163,6 +184,6 @@ if __name__ == "__main__":
 
     ## Output
 
-    df_out = textmatch_to_df(output_dict)
+    df_out = textmatch_to_df(output_dict, args.offsets_only)
     output_dict = None
-    df_out.to_csv(argv[3], sep=",", encoding="utf-8", index=False)
+    df_out.to_csv(args.output_path, sep=",", encoding="utf-8", index=False)
@@ -0,0 +1,84 @@
+"""
+This module registers the data sources a tag match can come from.
+
+The sources of a match are carried as an integer bitmask, in memory and on disk: bit `i` stands for `SOURCE_NAMES[i]`.
+Masks are only decoded to source names for human facing output.
+"""
+
+from ast import literal_eval
+from typing import Any, Iterable
+
+# Registered sources, new sources must be appended so existing masks keep their meaning
+SOURCE_NAMES: list[str] = ["ner", "tagger", "onet"]
+
+SrcMask = int
+
+
+def source_bit(src_name: str) -> SrcMask:
+    """
+    Returns the mask bit of a registered source.
+
+    :raises ValueError: if the source is not registered in `SOURCE_NAMES`
+    """
+    try:
+        return 1 << SOURCE_NAMES.index(src_name)
+    except ValueError:
+        raise ValueError(
+            f'unknown source "{src_name}", sources must be registered in sources.SOURCE_NAMES'
+        )
+
+
+def encode_sources(src_names: Iterable[str]) -> SrcMask:
+    mask = 0
+    for src_name in src_names:
+        mask |= source_bit(src_name)
+    return mask
+
+
+def decode_sources(mask: SrcMask) -> list[str]:
+    """
+    Returns the names of the sources in a mask, in registration order.
+    """
+    return [
+        src_name
+        for (src_idx, src_name) in enumerate(SOURCE_NAMES)
+        if mask & (1 << src_idx)
+    ]
+
+
+def source_count(mask: SrcMask) -> int:
+    return mask.bit_count()
+
+
+def first_source(mask: SrcMask) -> str:
+    """
+    Returns the name of the first source of a mask, in registration order.
+
+    :raises ValueError: if the mask is empty
+    """
+    if mask <= 0:
+        raise ValueError("empty source mask")
+    return SOURCE_NAMES[(mask & -mask).bit_length() - 1]
+
+
+def parse_src_field(raw_src: Any) -> SrcMask:
+    """
+    Reads a `src` field loaded from a csv file.
+
+    Both masks and the older list of source names format (e.g. "['ner', 'tagger']") are accepted.
+    """
+    if isinstance(raw_src, str) and raw_src.lstrip().startswith("["):
+        return encode_sources(literal_eval(raw_src))
+    return int(raw_src)
+
+
+__all__ = [
+    "SOURCE_NAMES",
+    "SrcMask",
+    "source_bit",
+    "encode_sources",
+    "decode_sources",
+    "source_count",
+    "first_source",
+    "parse_src_field",
+]
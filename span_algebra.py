@@ -0,0 +1,254 @@
+"""
+This module implements set operations over character spans.
+
+A span is a (char_start, char_end) tuple. Every operation sorts its input once and then walks it in a single pass.
+"""
+
+import heapq
+from itertools import repeat
+from typing import Iterable, Sequence
+
+Span = tuple[int, int]
+
+# membership flags returned by merge_span_sources
+IN_A = 1
+IN_B = 2
+
+
+def sort_spans(spans: Iterable[Span]) -> list[Span]:
+    """
+    Returns the distinct spans sorted by start then end.
+    """
+    return sorted(set(spans))
+
+
+def spans_overlap(span_a: Span, span_b: Span) -> bool:
+    """
+    Tells whether the end of one span falls within the other span.
+    """
+    (start_a, end_a) = span_a
+    (start_b, end_b) = span_b
+    return (start_b < end_a <= end_b) or (start_a < end_b <= end_a)
+
+
+def merge_span_sources(
+    spans_a: Sequence[Span], spans_b: Sequence[Span]
+) -> list[tuple[Span, int]]:
+    """
+    Walks two sorted and deduplicated span lists together.
+
+    Each distinct span is returned once, in order, along with its membership: `IN_A`, `IN_B` or `IN_A | IN_B`.
+    """
+    result: list[tuple[Span, int]] = []
+    idx_a, idx_b = 0, 0
+    len_a, len_b = len(spans_a), len(spans_b)
+
+    while idx_a < len_a and idx_b < len_b:
+        span_a = spans_a[idx_a]
+        span_b = spans_b[idx_b]
+        if span_a < span_b:
+            result.append((span_a, IN_A))
+            idx_a += 1
+        elif span_b < span_a:
+            result.append((span_b, IN_B))
+            idx_b += 1
+        else:
+            result.append((span_a, IN_A | IN_B))
+            idx_a += 1
+            idx_b += 1
+
+    result.extend((span, IN_A) for span in spans_a[idx_a:])
+    result.extend((span, IN_B) for span in spans_b[idx_b:])
+    return result
+
+
+def merge_many_span_sources(
+    span_lists: Sequence[Sequence[Span]],
+) -> list[tuple[Span, int]]:
+    """
+    Walks any number of sorted and deduplicated span lists together in a single k-way merge.
+
+    Each distinct span is returned once, in order, along with its membership mask: bit `i` is set when the span is in `span_lists[i]`.
+    With two lists the masks match the `IN_A` and `IN_B` flags.
+    """
+    result: list[tuple[Span, int]] = []
+    tagged_lists = (
+        zip(spans, repeat(1 << list_idx)) for (list_idx, spans) in enumerate(span_lists)
+    )
+    for span, membership in heapq.merge(*tagged_lists):
+        if result and result[-1][0] == span:
+            result[-1] = (span, result[-1][1] | membership)
+        else:
+            result.append((span, membership))
+    return result
+
+
+def span_union(spans_a: Sequence[Span], spans_b: Sequence[Span]) -> list[Span]:
+    """
+    Returns the sorted spans present in either sorted input.
+    """
+    return [span for (span, _) in merge_span_sources(spans_a, spans_b)]
+
+
+def span_intersection(spans_a: Sequence[Span], spans_b: Sequence[Span]) -> list[Span]:
+    """
+    Returns the sorted spans present in both sorted inputs.
+    """
+    return [
+        span
+        for (span, membership) in merge_span_sources(spans_a, spans_b)
+        if membership == IN_A | IN_B
+    ]
+
+
+def span_difference(spans_a: Sequence[Span], spans_b: Sequence[Span]) -> list[Span]:
+    """
+    Returns the sorted spans of `spans_a` that are not in `spans_b`.
+    """
+    return [
+        span
+        for (span, membership) in merge_span_sources(spans_a, spans_b)
+        if membership == IN_A
+    ]
+
+
+def maximal_span_indices(spans: Sequence[Span]) -> list[int]:
+    """
+    Returns the indexes of the spans that are not contained in any other span, in start order.
+
+    Of several identical spans, only the last one is kept.
+    """
+    order = sorted(range(len(spans)), key=lambda i: (spans[i][0], -spans[i][1], -i))
+
+    result: list[int] = []
+    max_end: int | None = None
+    for idx in order:
+        end = spans[idx][1]
+        if max_end is None or end > max_end:
+            result.append(idx)
+            max_end = end
+    return result
+
+
+def filter_contained(spans: Sequence[Span]) -> list[Span]:
+    """
+    Removes every span contained in another span. The result is sorted by start.
+    """
+    return [spans[idx] for idx in maximal_span_indices(spans)]
+
+
+def contained_mask(spans: Sequence[Span], containers: Iterable[Span]) -> list[bool]:
+    """
+    Tells, for each span, whether it lies within at least one of the `containers`.
+    """
+    sorted_containers = sorted(containers)
+    order = sorted(range(len(spans)), key=lambda i: spans[i])
+
+    result = [False] * len(spans)
+    container_idx = 0
+    max_end: int | None = None
+    for idx in order:
+        (start, end) = spans[idx]
+        while (
+            container_idx < len(sorted_containers)
+            and sorted_containers[container_idx][0] <= start
+        ):
+            container_end = sorted_containers[container_idx][1]
+            if max_end is None or container_end > max_end:
+                max_end = container_end
+            container_idx += 1
+        result[idx] = max_end is not None and end <= max_end
+    return result
+
+
+def overlap_pairs(spans: Sequence[Span]) -> list[tuple[int, int]]:
+    """
+    Returns every pair of indexes of overlapping spans, as defined by `spans_overlap`.
+
+    Spans are visited in start order (ties keep input order) and each pair is given in that order.
+    Scanning stops as soon as a later span starts after the current end, so the cost is proportional to the number of pairs.
+    """
+    order = sorted(range(len(spans)), key=lambda i: spans[i][0])
+
+    result: list[tuple[int, int]] = []
+    for pos, idx_a in enumerate(order):
+        span_a = spans[idx_a]
+        end_a = span_a[1]
+        for pos_b in range(pos + 1, len(order)):
+            idx_b = order[pos_b]
+            span_b = spans[idx_b]
+            if span_b[0] > end_a:
+                break
+            if spans_overlap(span_a, span_b):
+                result.append((idx_a, idx_b))
+    return result
+
+
+def _chain_end(
+    end: int, first_end_at: dict[int, int], max_gap: int, memo: dict[int, int]
+) -> int:
+    path: list[int] = []
+    while end not in memo:
+        path.append(end)
+        next_end = next(
+            (
+                first_end_at[end + gap]
+                for gap in range(max_gap + 1)
+                if end + gap in first_end_at
+            ),
+            None,
+        )
+        if next_end is None or next_end <= end:
+            memo[end] = end
+        else:
+            end = next_end
+
+    final_end = memo[end]
+    for visited in path:
+        memo[visited] = final_end
+    return final_end
+
+
+def chain_contiguous(spans: Sequence[Span], max_gap: int = 1) -> list[Span]:
+    """
+    Extends each span with the spans that follow it at most `max_gap` characters after its end.
+
+    Chaining is transitive and always follows the first span (by start, then input order) found after the current end.
+    Overlapping spans are not chained. The result is aligned with the input.
+    Spans are expected to be non empty.
+    """
+    first_end_at: dict[int, int] = dict()
+    for start, end in spans:
+        first_end_at.setdefault(start, end)
+
+    memo: dict[int, int] = dict()
+    return [
+        (start, _chain_end(end, first_end_at, max_gap, memo)) for (start, end) in spans
+    ]
+
+
+def coalesce_contiguous(spans: Sequence[Span], max_gap: int = 1) -> list[Span]:
+    """
+    Chains contiguous spans together and keeps only the resulting maximal spans, sorted by start.
+    """
+    return filter_contained(chain_contiguous(spans, max_gap))
+
+
+__all__ = [
+    "Span",
+    "IN_A",
+    "IN_B",
+    "sort_spans",
+    "spans_overlap",
+    "merge_span_sources",
+    "merge_many_span_sources",
+    "span_union",
+    "span_intersection",
+    "span_difference",
+    "maximal_span_indices",
+    "filter_contained",
+    "contained_mask",
+    "overlap_pairs",
+    "chain_contiguous",
+    "coalesce_contiguous",
+]
@@ -1,13 +1,16 @@
 #!/usr/bin/env -S uv run
 
-from itertools import islice
-from typing import TypedDict, cast
+from heapq import merge as heap_merge
+from typing import Iterator, TypedDict, cast
 
 import pandas
 
 import dfio
+from sources import SrcMask
+from span_algebra import spans_overlap
 from merge_stats import (
     NerPositionMatchSourced,
+    NerPositionsSourced,
     TextToNerPositionsSourced,
     cast_text_to_ner_position_sourced,
 )
@@ -20,84 +23,21 @@ class TagMatchStandalone(NerPositionMatchSourced):
 TagOverlap = tuple[TagMatchStandalone, TagMatchStandalone]
 
 
-class TagOverlapWrapper:
-    def __init__(self, tag_overlap: TagOverlap):
-        self._tag_overlap = sort_overlap(tag_overlap)
-        self._cached_hash: int | None = None
-
-    def __hash__(self) -> int:
-        if self._cached_hash is None:
-            self._cached_hash = hash(
-                (
-                    self._tag_overlap[0]["char_start"],
-                    self._tag_overlap[0]["char_end"],
-                    self._tag_overlap[0]["tag"],
-                    self._tag_overlap[1]["char_start"],
-                    self._tag_overlap[1]["char_end"],
-                    self._tag_overlap[1]["tag"],
-                )
-            )
-        return self._cached_hash
-
-    def __eq__(self, rhs: object, /) -> bool:
-        if not isinstance(rhs, TagOverlapWrapper):
-            raise ValueError()
-
-        match cmp_tag_match(self._tag_overlap[0], rhs._tag_overlap[0]):
-            case 0:
-                return cmp_tag_match(self._tag_overlap[1], rhs._tag_overlap[1]) == 0
-            case _:
-                return False
-
-    def __lt__(self, rhs: object) -> bool:
-        if not isinstance(rhs, TagOverlapWrapper):
-            raise ValueError()
-
-        match cmp_tag_match(self._tag_overlap[0], rhs._tag_overlap[0]):
-            case 0:
-                return cmp_tag_match(self._tag_overlap[1], rhs._tag_overlap[1]) < 0
-            case x if x < 0:
-                return True
-            case _:
-                return False
-
-    def unwrap(self) -> TagOverlap:
-        return self._tag_overlap
-
-
 def match_spread_len(tag_match: TagMatchStandalone) -> int:
     return tag_match["char_end"] - tag_match["char_start"]
 
 
-def cmp_tag_match(match_a: TagMatchStandalone, match_b: TagMatchStandalone) -> int:
-    A_LESSER_THAN_B = -1
-    A_GREATER_THAN_B = 1
-    A_EQUAL_B = 0
-
-    match (match_spread_len(match_a), match_spread_len(match_b)):
-        case (l_a, l_b) if l_a < l_b:
-            return A_LESSER_THAN_B
-        case (l_a, l_b) if l_a > l_b:
-            return A_GREATER_THAN_B
-
-    match (match_a["char_start"], match_b["char_start"]):
-        case (s_a, s_b) if s_a < s_b:
-            return A_LESSER_THAN_B
-        case (s_a, s_b) if s_a > s_b:
-            return A_GREATER_THAN_B
+# overlaps are ordered and deduplicated on these keys
+TagMatchKey = tuple[int, int, str]  # length, char_start, tag
 
-    match (match_a["tag"], match_b["tag"]):
-        case (t_a, t_b) if t_a < t_b:
-            return A_LESSER_THAN_B
-        case (t_a, t_b) if t_a > t_b:
-            return A_GREATER_THAN_B
 
-    return A_EQUAL_B
+def tag_match_key(tag_match: TagMatchStandalone) -> TagMatchKey:
+    return (match_spread_len(tag_match), tag_match["char_start"], tag_match["tag"])
 
 
 def sort_overlap(tag_overlap: TagOverlap) -> TagOverlap:
     (match_a, match_b) = tag_overlap
-    if cmp_tag_match(match_a, match_b) > 0:
+    if tag_match_key(match_a) > tag_match_key(match_b):
         return (match_b, match_a)
     return tag_overlap
 
@@ -105,15 +45,10 @@ def sort_overlap(tag_overlap: TagOverlap) -> TagOverlap:
 def are_matches_overlaping(
     match_a: TagMatchStandalone, match_b: TagMatchStandalone
 ) -> bool:
-    end_of_a_in_b = (
-        match_a["char_end"] > match_b["char_start"]
-        and match_a["char_end"] <= match_b["char_end"]
+    return spans_overlap(
+        (match_a["char_start"], match_a["char_end"]),
+        (match_b["char_start"], match_b["char_end"]),
     )
-    end_of_b_in_a = (
-        match_b["char_end"] > match_a["char_start"]
-        and match_b["char_end"] <= match_a["char_end"]
-    )
-    return end_of_a_in_b or end_of_b_in_a
 
 
 def df_to_dict_sourced(df: pandas.DataFrame) -> TextToNerPositionsSourced:
@@ -132,16 +67,51 @@ def sourced_dict_to_df(sourced_dict: TextToNerPositionsSourced) -> pandas.DataFr
 def get_cross_tag_overlap_per_text(
     match_list: list[TagMatchStandalone],
 ) -> list[TagOverlap]:
+    """
+    Sorts the matches of a text by start then sweeps them, see `sweep_sorted_overlaps`.
+    """
+    match_list.sort(key=lambda m: m["char_start"])
+    return sweep_sorted_overlaps(match_list)
+
+
+def sweep_sorted_overlaps(
+    match_list: list[TagMatchStandalone],
+) -> list[TagOverlap]:
+    """
+    Lists the overlapping pairs of a match list sorted by `char_start`.
+
+    Scanning stops as soon as a later match starts after the current end.
+    """
     result: list[TagOverlap] = []
 
-    match_list.sort(key=lambda m: m["char_start"])
     for idx, match_instance_a in enumerate(match_list):
-        for match_instance_b in islice(match_list, idx + 1, None, None):
+        end_a = match_instance_a["char_end"]
+        for idx_b in range(idx + 1, len(match_list)):
+            match_instance_b = match_list[idx_b]
+            if match_instance_b["char_start"] > end_a:
+                break
             if are_matches_overlaping(match_instance_a, match_instance_b):
                 result.append((match_instance_a, match_instance_b))
     return result
 
 
+def get_merged_text_overlaps(tag_dict: NerPositionsSourced) -> list[TagOverlap]:
+    """
+    Lists the deduplicated cross tag overlaps of a single merged text, in the order of `colision_list.csv`.
+
+    Match lists are expected sorted by `char_start`, as produced by the merge, so they are merged rather than sorted.
+    """
+    tag_match_lists = [
+        [
+            cast(TagMatchStandalone, match_instance | {"tag": tag_name})
+            for match_instance in match_list
+        ]
+        for (tag_name, match_list) in tag_dict.items()
+    ]
+    sorted_matches = list(heap_merge(*tag_match_lists, key=lambda m: m["char_start"]))
+    return dedup_overlaps(sweep_sorted_overlaps(sorted_matches))
+
+
 def get_cross_tag_overlap_all_texts(
     sourced_dict: dict[str, list[TagMatchStandalone]],
 ) -> dict[str, list[TagOverlap]]:
@@ -170,8 +140,19 @@ def get_all_tag_match(
 
 
 def dedup_overlaps(overlap_list: list[TagOverlap]) -> list[TagOverlap]:
-    deduped = set((TagOverlapWrapper(tag_overlap) for tag_overlap in overlap_list))
-    return list((d.unwrap() for d in sorted(deduped)))
+    """
+    Orders the matches of each overlap, then deduplicates and sorts the overlaps on their `tag_match_key`.
+
+    Of duplicated overlaps, the first one is kept.
+    """
+    deduped: dict[tuple[TagMatchKey, TagMatchKey], TagOverlap] = dict()
+    for match_a, match_b in overlap_list:
+        key_a = tag_match_key(match_a)
+        key_b = tag_match_key(match_b)
+        if key_a > key_b:
+            (match_a, match_b, key_a, key_b) = (match_b, match_a, key_b, key_a)
+        deduped.setdefault((key_a, key_b), (match_a, match_b))
+    return [deduped[overlap_key] for overlap_key in sorted(deduped)]
 
 
 def dedup_all_overlaps(
@@ -190,11 +171,14 @@ class OverlapDataset(TypedDict):
     tag_a: list[str]
     char_start_a: list[int]
     char_end_a: list[int]
-    src_a: list[str]
+    src_a: list[SrcMask]
     tag_b: list[str]
     char_start_b: list[int]
     char_end_b: list[int]
-    src_b: list[str]
+    src_b: list[SrcMask]
+
+
+OVERLAP_DATASET_COLUMNS = list(OverlapDataset.__annotations__)
 
 
 def text_overlaps_to_dataset(
@@ -204,11 +188,11 @@ def text_overlaps_to_dataset(
     tag_a: list[str] = []
     char_start_a: list[int] = []
     char_end_a: list[int] = []
-    src_a: list[str] = []
+    src_a: list[SrcMask] = []
     tag_b: list[str] = []
     char_start_b: list[int] = []
     char_end_b: list[int] = []
-    src_b: list[str] = []
+    src_b: list[SrcMask] = []
 
     for text_id_input, overlap_list in text_overlaps.items():
         for overlap in overlap_list:
@@ -218,12 +202,12 @@ def text_overlaps_to_dataset(
             tag_a.append(match_a["tag"])
             char_start_a.append(match_a["char_start"])
             char_end_a.append(match_a["char_end"])
-            src_a.append(repr(match_a["src"]))
+            src_a.append(match_a["src"])
 
             tag_b.append(match_b["tag"])
             char_start_b.append(match_b["char_start"])
             char_end_b.append(match_b["char_end"])
-            src_b.append(repr(match_b["src"]))
+            src_b.append(match_b["src"])
 
     return {
         "text_id": text_id,
@@ -238,6 +222,27 @@ def text_overlaps_to_dataset(
     }
 
 
+def text_overlap_rows(
+    text_id: str, overlap_list: list[TagOverlap]
+) -> Iterator[tuple[str, str, int, int, SrcMask, str, int, int, SrcMask]]:
+    """
+    Rows of the overlaps of a single text, in the column order of `text_overlaps_to_dataset`,
+    so overlaps can be written text by text.
+    """
+    for match_a, match_b in overlap_list:
+        yield (
+            text_id,
+            match_a["tag"],
+            match_a["char_start"],
+            match_a["char_end"],
+            match_a["src"],
+            match_b["tag"],
+            match_b["char_start"],
+            match_b["char_end"],
+            match_b["src"],
+        )
+
+
 if __name__ == "__main__":
     import sys
 
@@ -0,0 +1,31 @@
+#!/usr/bin/env -S uv run
+"""
+Prints the rows of a few texts of an indexed csv file (see dfio.NerPositionsIndex) without parsing the whole file.
+"""
+
+import csv
+import sys
+
+import dfio
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path", metavar="input.csv")
+    parser.add_argument("text_ids", nargs="+", metavar="sha512")
+    args = parser.parse_args()
+
+    missing_count = 0
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["sha512", "ner_positions"])
+    with dfio.NerPositionsIndex(args.input_path) as text_index:
+        for text_id in args.text_ids:
+            ner_positions_raw = text_index.lookup_raw(text_id)
+            if ner_positions_raw is None:
+                print(f"{text_id} not found", file=sys.stderr)
+                missing_count += 1
+            else:
+                writer.writerow([text_id, ner_positions_raw])
+
+    sys.exit(1 if missing_count else 0)
@@ -1,12 +1,13 @@
 #!/usr/bin/env -S uv run
 
 import sys
-from itertools import dropwhile, islice
+from itertools import dropwhile
 from typing import Callable, Optional, cast, Iterable
 
 import pandas
 
 import dfio
+from span_algebra import contained_mask, maximal_span_indices
 
 # PosAndWord = tuple[int, int, str]
 # TagDict = dict[str, list[PosAndWord]]
@@ -38,7 +39,7 @@ def sort_text_hierarchy_by_pos(text_tag_hierarchy: TextTagHierarchized):
         for _, prefix_dict in suffix_dict.items():
             for _, match_list in prefix_dict.items():
                 new_match_list = sorted(
-                    filter(lambda m: (m["char_start"] >= 0), match_list),
+                    filter(lambda m: m["char_start"] >= 0, match_list),
                     key=lambda m: m["char_start"],
                 )
                 match_list.clear()
@@ -138,29 +139,21 @@ def merge_tag_hierarchy(
             # Scooping up remaining unmerged tags without duplication
             #
             result_match_list.sort(key=lambda m: m["char_start"])
+            result_spans = [(m["char_start"], m["char_end"]) for m in result_match_list]
             additional_match_list: list[dfio.NerPositionsMatch] = []
-            for intermediate_match in prefix_dict.setdefault("I", []):
-                isintergrated = False
-                for result_match in result_match_list:
-                    if (
-                        intermediate_match["char_start"] >= result_match["char_start"]
-                        and intermediate_match["char_end"] <= result_match["char_end"]
-                    ):
-                        isintergrated = True
-                        break
-                if not isintergrated:
-                    additional_match_list.append(intermediate_match)
-            for last_match in prefix_dict.setdefault("L", []):
-                isintergrated = False
-                for result_match in result_match_list:
-                    if (
-                        last_match["char_start"] >= result_match["char_start"]
-                        and last_match["char_end"] <= result_match["char_end"]
-                    ):
-                        isintergrated = True
-                        break
-                if not isintergrated:
-                    additional_match_list.append(last_match)
+            for remaining_match_list in (
+                prefix_dict.setdefault("I", []),
+                prefix_dict.setdefault("L", []),
+            ):
+                integrated_mask = contained_mask(
+                    [(m["char_start"], m["char_end"]) for m in remaining_match_list],
+                    result_spans,
+                )
+                for remaining_match, isintergrated in zip(
+                    remaining_match_list, integrated_mask
+                ):
+                    if not isintergrated:
+                        additional_match_list.append(remaining_match)
             for additional_match in additional_match_list:
                 result_match_list.append(additional_match)
 
@@ -176,25 +169,14 @@ def merge_tag_hierarchy(
 def dedupe_merged_tags(
     match_itt: Iterable[dfio.NerPositionsMatch],
 ) -> list[dfio.NerPositionsMatch]:
-    match_list: list[dfio.NerPositionsMatch] = sorted(
-        match_itt, key=lambda m: m["char_end"] - m["char_start"]
+    match_list = list(match_itt)
+    spans = [(m["char_start"], m["char_end"]) for m in match_list]
+    # kept matches are listed shortest first, as the previous pairwise dedup did
+    kept_indexes = sorted(
+        maximal_span_indices(spans),
+        key=lambda idx: (spans[idx][1] - spans[idx][0], idx),
     )
-
-    result: list[dfio.NerPositionsMatch] = []
-
-    for idx, word_match in enumerate(match_list):
-        ignore = False
-        for word_compare in islice(match_list, idx + 1, None, None):
-            if (
-                word_match["char_start"] >= word_compare["char_start"]
-                and word_match["char_end"] <= word_compare["char_end"]
-            ):
-                ignore = True
-                break
-        if not ignore:
-            result.append(word_match)
-
-    return result
+    return [match_list[idx] for idx in kept_indexes]
 
 
 # def dual_iterator(itt: Iterable[T]) -> Iterable[tuple[T, T]]:
@@ -351,6 +333,4 @@ if __name__ == "__main__":
 
     output_work_data = process_text_dict(input_work_data)
 
-    output_df = dfio.dict_to_df(output_work_data)
-
-    output_df.to_csv(output_path, index=False)
+    dfio.write_csv(output_work_data, output_path)
@@ -1,33 +1,11 @@
 #!/usr/bin/env -S uv run
 
-import sys
-from itertools import islice
 from typing import Optional
 
 import pandas
 
 import dfio
-
-
-def smart_tag_merge(
-    tag_front: dfio.NerPositionsMatch, tag_rear: dfio.NerPositionsMatch
-) -> Optional[dfio.NerPositionsMatch]:
-    dist = tag_rear["char_start"] - tag_front["char_end"]
-    if dist < 0 or dist > 1:
-        return None
-
-    # if (tag_rear["char_end"] - tag_rear["char_start"]) < len(tag_rear["word"]):
-    #     tag_rear_fixed = cast(
-    #         dfio.NerPositionsMatch, tag_rear | {"word": tag_rear["word"][2:]}
-    #     )
-    # else:
-    #     tag_rear_fixed = tag_rear
-
-    return {
-        "char_start": tag_front["char_start"],
-        "char_end": tag_rear["char_end"],
-        "word": "",  # tag_front["word"] + tag_rear_fixed["word"],
-    }
+from span_algebra import chain_contiguous, maximal_span_indices
 
 
 def process_composite_tag(
@@ -71,27 +49,19 @@ def aglomerate_contiguous_tags(
         for tag, match_list in tag_dict.items():
             result_match_list = result_tag_dict.setdefault(tag, [])
             sorted_match_list = sorted(match_list, key=lambda m: m["char_start"])
-            for idx, match_a in enumerate(sorted_match_list):
-                match_result: dfio.NerPositionsMatch = match_a
-                for match_b in islice(sorted_match_list, idx + 1, None, None):
-                    match smart_tag_merge(match_result, match_b):
-                        case None:
-                            continue
-                        case new_match_result:
-                            match_result = new_match_result
-                result_match_list.append(match_result)
+            chained_spans = chain_contiguous(
+                [(m["char_start"], m["char_end"]) for m in sorted_match_list]
+            )
+            for match_a, (start, end) in zip(sorted_match_list, chained_spans):
+                if end == match_a["char_end"]:
+                    result_match_list.append(match_a)
+                else:
+                    result_match_list.append(
+                        {"char_start": start, "char_end": end, "word": ""}
+                    )
     return result
 
 
-def is_match_a_in_match_b(
-    match_a: dfio.NerPositionsMatch, match_b: dfio.NerPositionsMatch
-) -> bool:
-    return (
-        match_a["char_start"] >= match_b["char_start"]
-        and match_a["char_end"] <= match_b["char_end"]
-    )
-
-
 def dedup_aglomerated_tags(
     text_dict: dfio.TextToNerPositions,
 ) -> dfio.TextToNerPositions:
@@ -99,18 +69,13 @@ def dedup_aglomerated_tags(
     for text_id, tag_dict in text_dict.items():
         result_tag_dict = result.setdefault(text_id, dict())
         for tag, match_list in tag_dict.items():
-            result_match_list = result_tag_dict.setdefault(tag, [])
-            sorted_match_list = sorted(
-                match_list, key=lambda m: (m["char_end"] - m["char_start"])
+            spans = [(m["char_start"], m["char_end"]) for m in match_list]
+            # shortest first, as the previous pairwise dedup listed them
+            kept_indexes = sorted(
+                maximal_span_indices(spans),
+                key=lambda idx: (spans[idx][1] - spans[idx][0], idx),
             )
-            for idx, match_a in enumerate(sorted_match_list):
-                is_included = False
-                for match_b in islice(sorted_match_list, idx + 1, None, None):
-                    if is_match_a_in_match_b(match_a, match_b):
-                        is_included = True
-                        break
-                if not is_included:
-                    result_match_list.append(match_a)
+            result_tag_dict[tag] = [match_list[idx] for idx in kept_indexes]
     return result
 
 
@@ -120,14 +85,19 @@ def process_text_dict(text_dict: dfio.TextToNerPositions) -> dfio.TextToNerPosit
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(f"usage: {sys.argv[0]} input.csv output.csv")
-        sys.exit(1)
-
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path", metavar="input.csv")
+    parser.add_argument("output_path", metavar="output.csv")
+    parser.add_argument(
+        "--offsets-only",
+        action="store_true",
+        help="only write match offsets, words are left out",
+    )
+    args = parser.parse_args()
 
-    input_df = pandas.read_csv(input_path)
+    input_df = pandas.read_csv(args.input_path)
 
     input_work_data = dfio.df_to_dict(input_df)
     input_df = None
@@ -136,7 +106,4 @@ if __name__ == "__main__":
     output_work_data = process_text_dict(input_work_data)
     input_work_data = None
 
-    output_df = dfio.dict_to_df(output_work_data)
-    output_work_data = None
-
-    output_df.to_csv(output_path, index=False)
+    dfio.write_csv(output_work_data, args.output_path, offsets_only=args.offsets_only)
@@ -0,0 +1,75 @@
+"""
+Streams report rows to an .xlsx workbook, one sheet per major tag (first letter of the tag, as in merge_stats).
+
+Workbooks are written in openpyxl's write-only mode: rows go to disk as they are appended,
+so memory use does not grow with the number of rows.
+"""
+
+from typing import Any, Iterable, Optional, Sequence
+
+import pandas as pd
+from openpyxl import Workbook
+
+# characters excel does not accept in a sheet title
+_FORBIDDEN_TITLE_CHARS = str.maketrans({c: "_" for c in "[]:*?/\\"})
+
+
+def major_tag(tag: str) -> str:
+    return tag[0:1]
+
+
+def sheet_title(name: str) -> str:
+    return name.translate(_FORBIDDEN_TITLE_CHARS)[0:31] or "_"
+
+
+def write_rows_by_major_tag(
+    path: str,
+    header: Sequence[str],
+    rows: Iterable[Sequence[Any]],
+    tag_column: str,
+    *,
+    extra_sheets: Optional[dict[str, pd.DataFrame]] = None,
+) -> None:
+    """
+    Writes rows to a workbook, each row going to the sheet of the major tag found in `tag_column`.
+
+    Sheets are created as their first row comes, each starting with the header.
+    `extra_sheets` are small tables written whole after the rows, e.g. statistics.
+    """
+    tag_idx = list(header).index(tag_column)
+    workbook = Workbook(write_only=True)
+    sheets = dict()
+    for row in rows:
+        title = sheet_title(major_tag(str(row[tag_idx])))
+        sheet = sheets.get(title)
+        if sheet is None:
+            sheet = sheets[title] = workbook.create_sheet(title)
+            sheet.append(list(header))
+        sheet.append(list(row))
+
+    for name, df in (extra_sheets or dict()).items():
+        sheet = workbook.create_sheet(sheet_title(name))
+        sheet.append([str(column) for column in df.columns])
+        for row in df.itertuples(index=False, name=None):
+            sheet.append(list(row))
+
+    # a workbook needs at least one sheet
+    if not workbook.worksheets:
+        workbook.create_sheet().append(list(header))
+    workbook.save(path)
+
+
+def write_df_by_major_tag(
+    path: str,
+    df: pd.DataFrame,
+    tag_column: str,
+    *,
+    extra_sheets: Optional[dict[str, pd.DataFrame]] = None,
+) -> None:
+    write_rows_by_major_tag(
+        path,
+        [str(column) for column in df.columns],
+        df.itertuples(index=False, name=None),
+        tag_column,
+        extra_sheets=extra_sheets,
+    )